@@ -33,6 +33,14 @@ class adafruit_servo_wrapper:
   other motor control classes. For more details see roboclaw_wrapper.py
   """
 
+  # Deadbands and refresh interval used by roverchassis.roverwheel to skip
+  # sending commands that would not change anything.
+  # PWM pulse counts are integers, any change smaller than one count is not
+  # worth sending. The HAT holds its output indefinitely.
+  angle_deadband = 0
+  velocity_deadband = 0
+  refresh_interval = None
+
   def __init__(self):
     # Reference to the PWM controller object
     self.pwm = None
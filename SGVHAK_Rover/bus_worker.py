@@ -0,0 +1,116 @@
+"""
+MIT License
+
+Copyright (c) 2018 Roger Cheng
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import threading
+from collections import deque
+
+class bus_job:
+  """
+  A unit of work queued for a bus worker. Caller may wait for it to finish
+  and get its return value, any exception raised by the work is passed on
+  to the waiting caller.
+  A job replaced by a newer one before it started is done without running,
+  and superseded is set.
+  """
+  def __init__(self, function, args):
+    self.function = function
+    self.args = args
+    self.result = None
+    self.exception = None
+    self.superseded = False
+    self.done = threading.Event()
+
+  def run(self):
+    try:
+      self.result = self.function(*self.args)
+    except Exception as e:
+      self.exception = e
+    finally:
+      self.done.set()
+
+  def wait(self):
+    """
+    Block until the job is finished and return its result, raise its
+    exception if it failed.
+    """
+    self.done.wait()
+    if self.exception:
+      raise self.exception
+    return self.result
+
+class bus_worker(threading.Thread):
+  """
+  Worker thread dedicated to one motor control bus. (A serial port or I2C
+  bus, represented by one motor control object.) All work for that bus is
+  executed in order on this thread, so commands to different buses can be
+  sent at the same time while the ones sharing a bus never overlap.
+
+  Periodic work such as motion updates is submitted with submit_latest():
+  if the bus falls behind, a newer update replaces the one still waiting
+  instead of piling up behind it, like motion_mailbox does for commands.
+  """
+  def __init__(self, name):
+    threading.Thread.__init__(self, name=name)
+    self.setDaemon(True)
+
+    # Jobs waiting to run in order, guarded by condition.
+    self.condition = threading.Condition()
+    self.jobs = deque()
+
+  def submit(self, function, *args):
+    """
+    Queue function(*args) to run on this worker. Returns a bus_job that can
+    be used to wait for its completion.
+    """
+    job = bus_job(function, args)
+    with self.condition:
+      self.jobs.append(job)
+      self.condition.notify()
+    return job
+
+  def submit_latest(self, function, *args):
+    """
+    Same as submit(), except a job for the same function still waiting to
+    run is superseded: this one takes its place in line, and the old one is
+    marked done without running.
+    """
+    job = bus_job(function, args)
+    with self.condition:
+      for index, waiting in enumerate(self.jobs):
+        if waiting.function == function:
+          self.jobs[index] = job
+          waiting.superseded = True
+          waiting.done.set()
+          break
+      else:
+        self.jobs.append(job)
+      self.condition.notify()
+    return job
+
+  def run(self):
+    while True:
+      with self.condition:
+        while not self.jobs:
+          self.condition.wait()
+        job = self.jobs.popleft()
+      job.run()
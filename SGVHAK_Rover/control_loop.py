@@ -0,0 +1,255 @@
+"""
+MIT License
+
+Copyright (c) 2018 Roger Cheng
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import collections
+import ctypes
+import ctypes.util
+import logging
+import os
+import threading
+import time
+
+# Scheduling policy constant from Linux <sched.h>, for Python versions
+# without os.SCHED_FIFO
+SCHED_FIFO = 1
+
+class sched_param(ctypes.Structure):
+  """ struct sched_param from Linux <sched.h> """
+  _fields_ = [('sched_priority', ctypes.c_int)]
+
+def set_realtime(priority):
+  """
+  Switch the calling thread to SCHED_FIFO real-time scheduling at the given
+  priority. Raises OSError if not permitted.
+  """
+  if hasattr(os, 'sched_setscheduler'):
+    os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+    return
+
+  libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+  if libc.sched_setscheduler(0, SCHED_FIFO, ctypes.byref(sched_param(priority))) != 0:
+    errno = ctypes.get_errno()
+    raise OSError(errno, os.strerror(errno))
+
+def set_cpu(cpu):
+  """
+  Pin the calling thread to the given CPU core. Raises OSError if not
+  permitted.
+  """
+  if hasattr(os, 'sched_setaffinity'):
+    os.sched_setaffinity(0, [cpu])
+    return
+
+  # cpu_set_t is a 1024 bit mask
+  mask = (ctypes.c_ulong * (1024 // (8 * ctypes.sizeof(ctypes.c_ulong))))()
+  bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+  mask[cpu // bits] = 1 << (cpu % bits)
+
+  libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+  if libc.sched_setaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)) != 0:
+    errno = ctypes.get_errno()
+    raise OSError(errno, os.strerror(errno))
+
+def percentile(ordered, fraction):
+  """ Value at given fraction (0 to 1) of an already sorted list. """
+  if not ordered:
+    return 0
+  return ordered[min(len(ordered)-1, int(fraction * len(ordered)))]
+
+class control_loop(threading.Thread):
+  """
+  Fixed-rate control loop for the rover chassis. Every tick it picks up the
+  newest motion command from the chassis motion mailbox and applies it, so
+  motors are updated on a steady schedule instead of whenever a command
+  happens to arrive. Stop commands do not wait for the next tick.
+
+  Timing of every tick is recorded so the loop rate can be tuned for the
+  hardware at hand: see stats().
+  """
+  def __init__(self, chassis, frequency, realtime=False, priority=10, cpu=None,
+    profile=None, poll_interval=None, samples=1000):
+    threading.Thread.__init__(self, name="control_loop")
+    self.setDaemon(True)
+    self.chassis = chassis
+    self.mailbox = chassis.mailbox
+    self.period = 1.0/frequency
+
+    # Optional real-time scheduling priority and CPU core to pin to.
+    self.realtime = realtime
+    self.priority = priority
+    self.cpu = cpu
+
+    # What we actually got after asking for the above.
+    self.realtime_active = False
+    self.cpu_active = None
+
+    # Most recent motion command, applied every tick until replaced or stopped.
+    self.target = None
+
+    # Optional motion_profile to ramp towards target instead of jumping, and
+    # the setpoint it most recently produced.
+    self.profile = profile
+    self.setpoint = None
+    self.lasttick = None
+
+    # Seconds between calls to chassis.poll_controls(), None for never.
+    self.poll_interval = poll_interval
+    self.nextpoll = 0
+
+    # Timing statistics: recent tick periods and lateness (jitter) in
+    # seconds, count of ticks whose work ran past the next scheduled tick.
+    self.periods = collections.deque(maxlen=samples)
+    self.jitters = collections.deque(maxlen=samples)
+    self.ticks = 0
+    self.overruns = 0
+
+    self.on = True
+
+  def cancel(self):
+    self.on = False
+
+  def setup_scheduling(self):
+    """
+    Apply real-time scheduling and CPU pinning, if requested. Failure (usually
+    lack of permission) is logged and the loop runs under normal scheduling.
+    """
+    if self.realtime:
+      try:
+        set_realtime(self.priority)
+        self.realtime_active = True
+      except (OSError, AttributeError) as e:
+        logging.getLogger(__name__).warning("Control loop real-time scheduling unavailable: %s", str(e))
+
+    if self.cpu is not None:
+      try:
+        set_cpu(self.cpu)
+        self.cpu_active = self.cpu
+      except (OSError, AttributeError) as e:
+        logging.getLogger(__name__).warning("Control loop unable to use CPU %s: %s", self.cpu, str(e))
+
+  def apply_mailbox(self):
+    """ Pick up anything new from the mailbox and act on stops right away. """
+    stop, command = self.mailbox.take_nowait()
+    if stop:
+      self.target = None
+      self.setpoint = None
+      if self.profile:
+        self.profile.reset()
+      self.chassis.stop_wheels()
+    if command:
+      self.target = command
+      if self.profile:
+        self.profile.set_target(*command)
+
+  def tick(self):
+    """ Work done every tick. """
+    now = time.time()
+    self.apply_mailbox()
+
+    if not self.profile:
+      if self.target:
+        self.chassis.move_velocity_radius(*self.target)
+    elif self.target:
+      # Step profile by time actually elapsed, but not so far that a long
+      # stall turns into a jump.
+      if self.lasttick is None:
+        dt = self.period
+      else:
+        dt = min(now - self.lasttick, 4 * self.period)
+      # Send every tick even when the profile has settled: the chassis
+      # deadbands skip unchanged commands, and its refresh intervals
+      # resend them before motor controls time out.
+      self.setpoint = self.profile.step(dt)
+      self.chassis.move_velocity_radius(*self.setpoint)
+
+    self.lasttick = now
+
+    if self.poll_interval and now >= self.nextpoll:
+      self.nextpoll = now + self.poll_interval
+      self.chassis.poll_controls()
+
+  def run(self):
+    self.setup_scheduling()
+
+    scheduled = time.time()
+    previous = None
+
+    while self.on:
+      start = time.time()
+      self.ticks = self.ticks + 1
+      self.jitters.append(start - scheduled)
+      if previous is not None:
+        self.periods.append(start - previous)
+      previous = start
+
+      try:
+        self.tick()
+      except Exception as e:
+        logging.getLogger(__name__).error("Control loop tick failed: %s", str(e))
+
+      scheduled = scheduled + self.period
+      now = time.time()
+      if now > scheduled:
+        # Ran past the next tick. Skip the ticks we missed instead of
+        # trying to catch up with a burst.
+        self.overruns = self.overruns + 1
+        missed = int((now - scheduled) / self.period) + 1
+        scheduled = scheduled + missed * self.period
+
+      # Sleep until next tick, waking early to handle any stop command.
+      while self.on:
+        remaining = scheduled - time.time()
+        if remaining <= 0:
+          break
+        if self.mailbox.wait_urgent(remaining):
+          try:
+            self.tick()
+          except Exception as e:
+            logging.getLogger(__name__).error("Control loop stop failed: %s", str(e))
+
+  def stats(self):
+    """
+    Returns a dictionary of timing statistics over recent ticks. Times are
+    in milliseconds.
+    """
+    periods = list(self.periods)
+    jitters = sorted(self.jitters)
+
+    if periods:
+      period_mean = 1000 * sum(periods) / len(periods)
+    else:
+      period_mean = 0
+
+    return {
+      'frequency': 1.0/self.period,
+      'ticks': self.ticks,
+      'overruns': self.overruns,
+      'period_target': 1000 * self.period,
+      'period_mean': period_mean,
+      'period_max': 1000 * max(periods) if periods else 0,
+      'jitter_p50': 1000 * percentile(jitters, 0.50),
+      'jitter_p99': 1000 * percentile(jitters, 0.99),
+      'jitter_max': 1000 * jitters[-1] if jitters else 0,
+      'realtime': self.realtime_active,
+      'cpu': self.cpu_active,
+    }
@@ -0,0 +1,126 @@
+"""
+MIT License
+
+Copyright (c) 2018 Roger Cheng
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import logging
+import time
+
+class device_health:
+  """
+  Tracks how quickly each device on a serial bus answers, to wait only as
+  long as that device normally needs instead of a fixed worst case timeout.
+  Devices are identified by whatever the bus uses (servo ID, RoboClaw
+  address, ...).
+
+  Timeout is smoothed round trip time plus four times its variation, the
+  same estimate TCP uses for retransmission, kept between min_timeout and
+  max_timeout. Until a device has answered once there is no estimate, and
+  initial_timeout is used instead: long enough for any device on a working
+  bus, short enough that one missing from the bus doesn't hold up every
+  motion update. Each failure doubles the timeout for the next attempt in
+  case the estimate was too tight.
+
+  After 'threshold' consecutive failures the circuit to a device is open:
+  callers should skip it instead of waiting on it every time. Once every
+  probe_interval seconds one attempt is let through to see if it is back.
+  """
+
+  def __init__(self, name, max_timeout, min_timeout=0.01, initial_timeout=0.05, threshold=3, probe_interval=2.0):
+    self.name = name
+    self.max_timeout = max_timeout
+    self.min_timeout = min_timeout
+    self.initial_timeout = initial_timeout
+    self.threshold = threshold
+    self.probe_interval = probe_interval
+
+    # Dictionary of device to state list of [smoothed round trip time,
+    # round trip time variation, consecutive failures, timeout multiplier,
+    # time of next probe or None if circuit is closed]
+    self.devices = dict()
+
+  def state(self, device):
+    """ Returns state list for device, starting one if needed """
+    state = self.devices.get(device)
+    if state is None:
+      state = [None, None, 0, 1, None]
+      self.devices[device] = state
+    return state
+
+  def timeout(self, device):
+    """ Seconds to wait for a reply from device """
+    srtt, rttvar, failures, backoff, probe = self.state(device)
+    if probe is not None:
+      # Probing a device that stopped answering, waiting longer than usual
+      # would not tell us anything new.
+      backoff = 1
+    if srtt is None:
+      timeout = self.initial_timeout * backoff
+    else:
+      timeout = (srtt + 4 * rttvar) * backoff
+    return min(self.max_timeout, max(self.min_timeout, timeout))
+
+  def is_open(self, device):
+    """ True if device has stopped answering """
+    return self.state(device)[4] is not None
+
+  def skip(self, device):
+    """
+    True if caller should not talk to device because its circuit is open.
+    When it is time to probe returns False once, and the caller's attempt
+    serves as the probe.
+    """
+    state = self.state(device)
+    if state[4] is None:
+      return False
+    now = time.time()
+    if now < state[4]:
+      return True
+    state[4] = now + self.probe_interval
+    return False
+
+  def success(self, device, rtt=None):
+    """
+    Record a successful exchange with device, with its round trip time in
+    seconds if it was a single request and reply.
+    """
+    state = self.state(device)
+    if rtt is not None:
+      if state[0] is None:
+        state[0] = rtt
+        state[1] = rtt / 2
+      else:
+        state[1] = state[1] * 0.75 + abs(state[0] - rtt) * 0.25
+        state[0] = state[0] * 0.875 + rtt * 0.125
+    state[2] = 0
+    state[3] = 1
+    if state[4] is not None:
+      state[4] = None
+      logging.getLogger(__name__).info("{} device {} is answering again".format(self.name, device))
+
+  def failure(self, device):
+    """ Record an exchange with device that got no valid reply in time """
+    state = self.state(device)
+    state[2] = state[2] + 1
+    state[3] = min(state[3] * 2, 8)
+    if state[4] is None and state[2] >= self.threshold:
+      state[4] = time.time() + self.probe_interval
+      logging.getLogger(__name__).warning("{} device {} not answering, skipping it until it does".format(self.name, device))
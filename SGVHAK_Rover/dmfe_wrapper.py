@@ -41,6 +41,15 @@ class dmfe_wrapper:
   Class that implements the rover motor control methods for David M Flynn
   Enterprises motor control boards.
   """
+
+  # Deadbands and refresh interval used by roverchassis.roverwheel to skip
+  # sending commands that would not change anything.
+  # Position is 4096 counts per revolution, power has 50 steps for 100
+  # percent. Every command is acknowledged so there is no need to refresh.
+  angle_deadband = 0.1
+  velocity_deadband = 1
+  refresh_interval = None
+
   def __init__(self):
     self.sp = None
 
@@ -0,0 +1,792 @@
+"""
+MIT License
+
+Copyright (c) 2018 Roger Cheng
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import logging
+import serial
+import time
+from struct import *
+
+import configuration
+import device_health
+import frame_parser
+from dynamixel_wrapper import bytetohex
+
+# Instructions used from Robotis Dynamixel Protocol 2.0
+# http://emanual.robotis.com/docs/en/dxl/protocol2/
+PING = 0x01
+READ = 0x02
+WRITE = 0x03
+STATUS = 0x55
+SYNC_READ = 0x82
+SYNC_WRITE = 0x83
+FAST_SYNC_READ = 0x8A
+
+BROADCAST_ID = 0xFE
+
+HEADER = bytearray([0xFF, 0xFF, 0xFD, 0x00])
+
+# X-series control table addresses (RAM area unless noted)
+OPERATING_MODE = 11   # EEPROM, 1 byte: 1 = velocity control, 3 = position control
+STATUS_RETURN_LEVEL = 68
+TORQUE_ENABLE = 64
+GOAL_VELOCITY = 104   # 4 bytes, signed
+GOAL_POSITION = 116   # 4 bytes, 0-4095 for one revolution
+PRESENT_CURRENT = 126 # Start of telemetry block through PRESENT_TEMPERATURE
+PRESENT_INPUT_VOLTAGE = 144
+PRESENT_TEMPERATURE = 146
+
+VELOCITY_MODE = 1
+POSITION_MODE = 3
+
+# Telemetry block: present current, velocity, position, velocity trajectory,
+# position trajectory, input voltage, temperature.
+telemetry_block = Struct('<hiiiiHB')
+
+def crc_entry(index):
+  crc = index << 8
+  for bit in range(8):
+    if crc & 0x8000:
+      crc = (crc << 1) ^ 0x8005
+    else:
+      crc = crc << 1
+  return crc & 0xFFFF
+
+# CRC-16 polynomial 0x8005 used by Protocol 2.0, one entry per byte value.
+crc_table = [crc_entry(index) for index in range(256)]
+
+def crc16(data, crc=0):
+  """ Protocol 2.0 CRC of a bytearray """
+  for b in data:
+    crc = ((crc << 8) ^ crc_table[((crc >> 8) ^ b) & 0xFF]) & 0xFFFF
+  return crc
+
+def stuff(data):
+  """
+  Byte stuffing: wherever FF FF FD appears in instruction and parameters,
+  add an extra FD so it can't be mistaken for a packet header.
+  """
+  out = bytearray()
+  for b in data:
+    out.append(b)
+    if b == 0xFD and len(out) >= 3 and out[-3] == 0xFF and out[-2] == 0xFF:
+      out.append(0xFD)
+  return out
+
+def unstuff(data):
+  """ Reverse of stuff() """
+  out = bytearray()
+  skip = False
+  for b in data:
+    if skip:
+      skip = False
+      if b == 0xFD:
+        continue
+    out.append(b)
+    if b == 0xFD and len(out) >= 3 and out[-3] == 0xFF and out[-2] == 0xFF:
+      skip = True
+  return out
+
+def encode(servo_id, instruction, params=None):
+  """ Build a complete Protocol 2.0 packet as bytearray. """
+  if servo_id < 0 or servo_id > 0xFE:
+    raise ValueError("Servo ID {} is out of valid range".format(servo_id))
+
+  body = bytearray([instruction])
+  if params:
+    body.extend(params)
+  body = stuff(body)
+
+  packet = HEADER + bytearray([servo_id]) + bytearray(pack('<H', len(body) + 2)) + body
+  packet.extend(pack('<H', crc16(packet)))
+  return packet
+
+def decode(packet):
+  """
+  Validate a complete packet and return (ID, instruction, parameters)
+  with stuffing removed. Raises ValueError if packet is not valid.
+  """
+  if len(packet) < 10:
+    raise ValueError("Need at least 10 bytes for a valid packet, received {}".format(len(packet)))
+
+  if packet[0:4] != HEADER:
+    raise ValueError("Packet header is {}, expected fffffd00".format(bytetohex(packet[0:4])))
+
+  length = unpack_from('<H', bytes(packet[5:7]))[0]
+  if length + 7 != len(packet):
+    raise ValueError("Packet claims to have {} bytes after header, but we have {} bytes.".format(length, len(packet)-7))
+
+  crc = unpack_from('<H', bytes(packet[-2:]))[0]
+  if crc != crc16(packet[:-2]):
+    raise ValueError("Packet CRC {:04x} does not match calculated CRC {:04x}".format(crc, crc16(packet[:-2])))
+
+  body = unstuff(packet[7:-2])
+  return (packet[4], body[0], body[1:])
+
+class protocol2_parser(frame_parser.frame_parser):
+  """
+  Protocol 2.0 packets, skipping stray bytes, broken packets and echoes
+  the same way frame_parser does for Protocol 1.0. Differs in a four byte
+  header, a two byte length after ID (counting instruction, parameters and
+  CRC) and a CRC-16 in place of the checksum. Byte stuffing keeps the
+  header from appearing inside a valid packet.
+
+  Returns (id, instruction, parameters) as decode() does, parameters being
+  an empty bytearray for a packet without any.
+  """
+  header = HEADER
+  overhead = 7
+  min_length = 3
+
+  # Enough for a fast sync read of telemetry from several servos.
+  max_length = 512
+
+  invalid_ids = (0xFF,)
+
+  def frame(self):
+    buf = self.buffer
+    while True:
+      start = buf.find(self.header)
+      if start < 0:
+        # Keep trailing bytes, they might be the start of a header.
+        del buf[:max(0, len(buf)-3)]
+        return None
+      del buf[:start]
+
+      if len(buf) < self.overhead:
+        return None
+      length = unpack_from('<H', bytes(buf[5:7]))[0]
+      if buf[4] in self.invalid_ids or length < self.min_length or length > self.max_length:
+        del buf[0]
+        continue
+      end = length + self.overhead
+      if len(buf) < end:
+        return None
+
+      try:
+        packet = decode(buf[:end])
+      except ValueError:
+        del buf[0]
+        continue
+
+      if buf[:end] in self.echoes:
+        self.echoes.remove(buf[:end])
+        del buf[:end]
+        continue
+
+      del buf[:end]
+      return packet
+
+class dynamixel_emulator:
+  """
+  Byte level emulation of X-series Dynamixel servos speaking Protocol 2.0,
+  standing in for the serial port when it is configured as "TEST". Every
+  servo ID answers. Present position and velocity follow goal immediately.
+  """
+  def __init__(self):
+    self.servos = dict()
+    self.incoming = bytearray()
+    self.outgoing = bytearray()
+    self.is_open = True
+    self.timeout = 0
+
+  def servo(self, sid):
+    if sid not in self.servos:
+      table = bytearray(147)
+      table[0:2] = pack('<H', 1020) # Model number of XM430-W350
+      table[OPERATING_MODE] = POSITION_MODE
+      table[STATUS_RETURN_LEVEL] = 2
+      table[PRESENT_INPUT_VOLTAGE:PRESENT_INPUT_VOLTAGE+2] = pack('<H', 120)
+      table[PRESENT_TEMPERATURE] = 30
+      table[GOAL_POSITION:GOAL_POSITION+4] = pack('<i', 2048)
+      self.servos[sid] = table
+      self.update(sid)
+    return self.servos[sid]
+
+  def update(self, sid):
+    table = self.servos[sid]
+    table[132:136] = table[GOAL_POSITION:GOAL_POSITION+4]
+    if table[TORQUE_ENABLE] and table[OPERATING_MODE] == VELOCITY_MODE:
+      table[128:132] = table[GOAL_VELOCITY:GOAL_VELOCITY+4]
+    else:
+      table[128:132] = pack('<i', 0)
+
+  def status(self, sid, params=bytearray(), error=0):
+    self.outgoing.extend(encode(sid, STATUS, bytearray([error]) + params))
+
+  def replies(self, sid, instruction):
+    level = self.servos[sid][STATUS_RETURN_LEVEL]
+    return instruction == PING or level == 2 or (level == 1 and instruction == READ)
+
+  def execute(self, sid, instruction, params):
+    if instruction == SYNC_WRITE:
+      address, length = unpack_from('<HH', bytes(params))
+      for offset in range(4, len(params), length + 1):
+        target = params[offset]
+        self.servo(target)[address:address+length] = params[offset+1:offset+1+length]
+        self.update(target)
+    elif instruction in (SYNC_READ, FAST_SYNC_READ):
+      address, length = unpack_from('<HH', bytes(params))
+      targets = params[4:]
+      if instruction == SYNC_READ:
+        for target in targets:
+          self.status(target, self.servo(target)[address:address+length])
+      else:
+        body = bytearray()
+        for index, target in enumerate(targets):
+          if index > 0:
+            body.extend(pack('<H', crc16(body)))
+            body.append(0)
+          body.append(target)
+          body.extend(self.servo(target)[address:address+length])
+        self.status(BROADCAST_ID, body)
+    elif sid != BROADCAST_ID:
+      table = self.servo(sid)
+      if instruction == WRITE:
+        address = unpack_from('<H', bytes(params))[0]
+        table[address:address+len(params)-2] = params[2:]
+        self.update(sid)
+      if not self.replies(sid, instruction):
+        return
+      if instruction == READ:
+        address, length = unpack_from('<HH', bytes(params))
+        self.status(sid, table[address:address+length])
+      else:
+        self.status(sid)
+
+  def write(self, data):
+    self.incoming.extend(data)
+    while len(self.incoming) >= 10:
+      start = self.incoming.find(HEADER)
+      if start < 0:
+        del self.incoming[:-3]
+        return len(data)
+      del self.incoming[:start]
+      if len(self.incoming) < 7:
+        break
+      size = 7 + unpack_from('<H', bytes(self.incoming[5:7]))[0]
+      if len(self.incoming) < size:
+        break
+      packet = self.incoming[:size]
+      del self.incoming[:size]
+      sid, instruction, params = decode(packet)
+      self.execute(sid, instruction, params)
+    return len(data)
+
+  def read(self, size=1):
+    data = self.outgoing[:size]
+    del self.outgoing[:size]
+    return bytes(data)
+
+  @property
+  def in_waiting(self):
+    return len(self.outgoing)
+
+  def reset_input_buffer(self):
+    self.outgoing = bytearray()
+
+  def close(self):
+    self.is_open = False
+
+class dynamixel_protocol2:
+  """
+  Class that implements the rover motor control methods for Dynamixel serial
+  bus servos by Robotis that speak Protocol 2.0, such as the X series. Same
+  interface and motor identifiers as dynamixel_wrapper, selected with
+  "protocol": 2 in connect parameters of config_dynamixel.json.
+  """
+
+  # Deadbands and refresh interval used by roverchassis.roverwheel to skip
+  # sending commands that would not change anything.
+  # Goal position is about 11.4 counts per degree. SYNC_WRITE gets no
+  # status reply, so values are sent again every refresh_interval seconds
+  # in case one was lost, unless sync_write is turned off and every write
+  # returns status. See dynamixel_wrapper.
+  angle_deadband = 0.1
+  velocity_deadband = 0.1
+  refresh_interval = 2.0
+
+  def __init__(self):
+    self.sp = None
+
+    # Reassembles status packets from whatever bytes have arrived.
+    self.parser = protocol2_parser()
+
+    # Goal velocity at 100 percent, in units of 0.229 rpm.
+    self.max_velocity = 200
+
+    # Status return level we want servos to use, and level each servo is
+    # known to be at. See dynamixel_wrapper.
+    self.status_return_level = 2
+    self.status_levels = dict()
+
+    # Read telemetry with one FAST_SYNC_READ reply packet for all servos
+    # instead of SYNC_READ with one reply packet per servo.
+    self.fast_sync_read = False
+
+    # Send batches as SYNC_WRITE instead of a WRITE per servo.
+    self.use_sync_write = True
+
+    # Most recent health reading of each servo, see dynamixel_wrapper.
+    self.health = dict()
+
+    # Reply time of each servo and servos not answering, see
+    # dynamixel_wrapper.
+    self.devicehealth = device_health.device_health("Dynamixel", 0.5)
+    self.senttime = 0
+
+  def check_sp(self):
+    """ Raises error if we haven't opened serial port yet. """
+    if self.sp == None:
+      raise ValueError("Dynamixel serial communication is not available.")
+
+  def connect(self):
+    """
+    Read serial port connection parameters from JSON configuration file
+    and open the port, or start emulator if port is "TEST".
+    """
+    config = configuration.configuration("dynamixel")
+    allparams = config.load()
+    connectparams = allparams['connect']
+    self.status_return_level = allparams.get('status_return_level', self.status_return_level)
+    self.max_velocity = allparams.get('max_velocity', self.max_velocity)
+    self.fast_sync_read = allparams.get('telemetry', dict()).get('fast_sync_read', self.fast_sync_read)
+    self.use_sync_write = allparams.get('sync_write', self.use_sync_write)
+    if not self.use_sync_write and self.status_return_level == 2:
+      self.refresh_interval = None
+
+    if connectparams['port'] == 'TEST':
+      self.sp = dynamixel_emulator()
+      return
+
+    s = serial.Serial()
+    s.baudrate = connectparams['baudrate']
+    s.port = connectparams['port']
+    s.timeout = connectparams['timeout']
+    self.devicehealth.max_timeout = s.timeout
+    s.open()
+
+    if s.is_open:
+      self.sp = s
+
+  def close(self):
+    """
+    Closes down the serial port
+    """
+    if self.sp.is_open:
+      self.sp.close()
+      self.sp = None
+
+  def send(self, servo_id, instruction, params=None):
+    """ Send an instruction packet to a servo """
+    self.check_sp()
+    packet = encode(servo_id, instruction, params)
+    self.sp.write(packet)
+    self.parser.sent(packet)
+    self.senttime = time.time()
+
+  def clear_input(self):
+    """ Discard anything received and not yet read """
+    self.sp.reset_input_buffer()
+    self.parser.reset()
+
+  def read_packet(self, timeout=None):
+    """
+    Read the next valid packet, waiting up to timeout (default is the
+    port's). Returns (ID, instruction, parameters), or None if none arrived
+    in time.
+    """
+    self.check_sp()
+    return self.parser.read(self.sp, timeout)
+
+  def read_status(self, expectedid=None, expectederr=None, expectedparams=None):
+    """
+    Read one status packet and return (ID, error, parameters). Raises
+    ValueError if packet is incomplete, invalid, or doesn't match the
+    optional expectations. When a reply is expected from one servo, waits
+    only as long as that servo normally needs and tracks its health.
+    """
+    if expectedid is None or expectedid == BROADCAST_ID:
+      packet = self.read_packet()
+    else:
+      packet = self.read_packet(self.devicehealth.timeout(expectedid))
+      if packet is None:
+        self.devicehealth.failure(expectedid)
+      elif packet[0] == expectedid:
+        self.devicehealth.success(expectedid, time.time() - self.senttime)
+    return self.check_status(packet, expectedid, expectederr, expectedparams)
+
+  def check_status(self, packet, expectedid=None, expectederr=None, expectedparams=None):
+    """
+    Validate a status packet read by read_packet() against expected values.
+    See read_status() for details.
+    """
+    if packet is None:
+      raise ValueError("No valid packet received before timeout")
+    rid, instruction, params = packet
+    if instruction != STATUS:
+      raise ValueError("Expected status packet, received instruction {:02x}".format(instruction))
+    if len(params) < 1:
+      raise ValueError("Status packet has no error field")
+    rerr = params[0]
+    params = params[1:]
+
+    if expectedid != None and expectedid != rid:
+      raise ValueError("Response stamped with ID {}, expected {}".format(rid, expectedid))
+    if expectederr != None and expectederr != rerr:
+      raise ValueError("Response error {}, expected {}".format(rerr, expectederr))
+    if expectedparams != None and expectedparams != len(params):
+      raise ValueError("Received {} bytes of parameters, expected {}".format(len(params), expectedparams))
+
+    return (rid, rerr, params)
+
+  def write_data(self, sid, address, data):
+    """
+    WRITE to a servo's control table, waiting for status only if the servo
+    is configured to send one for writes.
+    """
+    self.send(sid, WRITE, bytearray(pack('<H', address)) + bytearray(data))
+    if self.status_levels.get(sid, 2) == 2:
+      self.read_status(expectedid=sid, expectederr=0, expectedparams=0)
+
+  def read_data(self, sid, address, length):
+    """ READ from a servo's control table, returns bytearray. """
+    self.send(sid, READ, pack('<HH', address, length))
+    (rid, err, params) = self.read_status(expectedid=sid, expectederr=0, expectedparams=length)
+    return params
+
+  def sync_write(self, address, length, items):
+    """
+    Write 'length' bytes at control table 'address' on several servos with
+    a single SYNC_WRITE broadcast. Items is a list of (servo ID, data).
+    """
+    params = bytearray(pack('<HH', address, length))
+    for sid, data in items:
+      if len(data) != length:
+        raise ValueError("Servo {} sync write of {} bytes, expected {}".format(sid, len(data), length))
+      params.append(sid)
+      params.extend(data)
+    self.send(BROADCAST_ID, SYNC_WRITE, params)
+
+  def sync_read(self, address, length, sids):
+    """
+    Read 'length' bytes at control table 'address' from several servos with
+    one SYNC_READ (a reply packet per servo) or FAST_SYNC_READ (one reply
+    packet for all). Returns list of (servo ID, error, data) in order.
+    Servos that stopped answering are not asked, and with SYNC_READ a servo
+    that fails to reply is left out of the list instead of failing the
+    others. A FAST_SYNC_READ missing a servo can't tell which one, so it is
+    repeated as a SYNC_READ.
+    """
+    sids = [sid for sid in sids if not self.devicehealth.skip(sid)]
+    if not sids:
+      return list()
+
+    self.clear_input()
+    params = bytearray(pack('<HH', address, length)) + bytearray(sids)
+
+    if not self.fast_sync_read:
+      self.send(BROADCAST_ID, SYNC_READ, params)
+      return self.sync_read_replies(length, sids)
+
+    self.send(BROADCAST_ID, FAST_SYNC_READ, params)
+    try:
+      results = self.fast_sync_read_reply(length, sids)
+    except ValueError as e:
+      logging.getLogger(__name__).debug(str(e))
+      self.clear_input()
+      self.send(BROADCAST_ID, SYNC_READ, params)
+      return self.sync_read_replies(length, sids)
+
+    rtt = (time.time() - self.senttime) / len(sids)
+    for sid in sids:
+      self.devicehealth.success(sid, rtt)
+    return results
+
+  def sync_read_replies(self, length, sids):
+    """
+    Collect SYNC_READ status packets, which servos send one after another
+    in the order asked. Returns list of (servo ID, error, data) of servos
+    that replied.
+    """
+    results = list()
+    remaining = list(sids)
+    while remaining:
+      sid = remaining[0]
+      packet = self.read_packet(self.devicehealth.timeout(sid))
+      try:
+        (rid, err, data) = self.check_status(packet, expectedparams=length)
+      except ValueError as e:
+        logging.getLogger(__name__).debug("Servo {} sync read: {}".format(sid, str(e)))
+        self.devicehealth.failure(sid)
+        remaining.pop(0)
+        continue
+      if rid not in remaining:
+        continue
+
+      # Servos ahead of this one in the order didn't reply.
+      index = remaining.index(rid)
+      for missing in remaining[:index]:
+        self.devicehealth.failure(missing)
+      del remaining[:index+1]
+
+      # Each servo replies after the one before it, so its round trip is
+      # the time since the previous reply.
+      now = time.time()
+      self.devicehealth.success(rid, now - self.senttime)
+      self.senttime = now
+      results.append((rid, err, data))
+    return results
+
+  def fast_sync_read_reply(self, length, sids):
+    """
+    Read the single FAST_SYNC_READ status packet and split it into a list
+    of (servo ID, error, data) in order. Raises ValueError if it did not
+    arrive intact with every servo in it.
+    """
+    (rid, err, body) = self.check_status(self.read_packet(), expectedid=BROADCAST_ID)
+
+    # Body has ID and data of first servo (its error is the packet error),
+    # then for each following servo: two bytes of CRC, error, ID, data.
+    expected = len(sids) * (length + 4) - 3
+    if len(body) != expected:
+      raise ValueError("Fast sync read of {} servos returned {} bytes, expected {}".format(len(sids), len(body), expected))
+
+    results = list()
+    offset = 0
+    for index, sid in enumerate(sids):
+      if index > 0:
+        err = body[offset+2]
+        offset = offset + 3
+      if body[offset] != sid:
+        raise ValueError("Fast sync read reply {} is from ID {}, expected {}".format(index, body[offset], sid))
+      results.append((sid, err, body[offset+1:offset+1+length]))
+      offset = offset + 1 + length
+    return results
+
+  def version(self, id):
+    """ Identifier string for this motor controller """
+    return "Dynamixel Protocol 2.0"
+
+  @staticmethod
+  def check_id(id):
+    """ Verifies servo ID is within range and inverted status is boolean"""
+    if not isinstance(id, (tuple,list)):
+      raise ValueError("Dynamixel identifier must be a tuple")
+
+    if not isinstance(id[0], int):
+      raise ValueError("Dynamixel servo address must be an integer")
+
+    if id[0] < 0 or id[0] > 252:
+      raise ValueError("Dynamixel servo address {} outside of valid range 0-252".format(id[0]))
+
+    if not isinstance(id[1], int):
+      raise ValueError("Dynamixel servo center position must be an integer")
+
+    if not isinstance(id[2], bool):
+      raise ValueError("Inverted status must be a boolean")
+
+    return tuple(id)
+
+  def set_status_return_level(self, sid):
+    """
+    Set servo's status return level to configured value, unless already
+    done. Same approach as dynamixel_wrapper: read it back, allowing for a
+    status packet for the write arriving first, except at level zero which
+    gives no reply to read.
+    """
+    level = self.status_return_level
+    if self.status_levels.get(sid) == level:
+      return
+
+    self.clear_input()
+    if level == 0:
+      self.send(sid, WRITE, bytearray(pack('<HB', STATUS_RETURN_LEVEL, level)))
+      if self.status_levels.get(sid, 2) == 2:
+        # Status for the write still comes at the old level.
+        self.read_packet(self.devicehealth.timeout(sid))
+      self.status_levels[sid] = level
+      return
+
+    self.send(sid, WRITE, bytearray(pack('<HB', STATUS_RETURN_LEVEL, level)))
+    self.send(sid, READ, pack('<HH', STATUS_RETURN_LEVEL, 1))
+
+    (rid, err, params) = self.read_status(expectedid=sid, expectederr=0)
+    if len(params) == 0:
+      # Status for the write, the read reply follows.
+      (rid, err, params) = self.read_status(expectedid=sid, expectederr=0, expectedparams=1)
+
+    if params[0] != level:
+      raise ValueError("Servo {} status return level is {} after setting it to {}".format(sid, params[0], level))
+    self.status_levels[sid] = level
+
+  def set_mode(self, sid, mode):
+    """
+    Operating mode can only be changed with torque off. Sets mode and turns
+    torque back on.
+    """
+    self.set_status_return_level(sid)
+    self.write_data(sid, TORQUE_ENABLE, (0,))
+    self.write_data(sid, OPERATING_MODE, (mode,))
+    self.write_data(sid, TORQUE_ENABLE, (1,))
+
+  def goal_velocity(self, id, percentage):
+    """
+    Returns (servo ID, goal velocity register value) for velocity()
+    """
+    sid, center, inverted = self.check_id(id)
+    self.check_sp()
+
+    if inverted:
+      percentage = percentage * -1
+
+    if abs(int(percentage)) > 100:
+      raise ValueError("Motor power percentage {0} outside valid range from 0 to 100.".format(percentage))
+
+    return (sid, int(self.max_velocity * percentage / 100))
+
+  def goal_position(self, id, angle):
+    """
+    Returns (servo ID, goal position register value) for angle()
+    """
+    sid, center, inverted = self.check_id(id)
+    self.check_sp()
+
+    if abs(angle) > 95:
+      raise ValueError("Steering angle {} exceeded expected maximum of 90".format(angle))
+
+    if inverted:
+      angle = angle * -1
+
+    return (sid, int(2048 + angle * 4096 / 360.0))
+
+  def power_percent(self, id, percentage):
+    """ Runs servo in velocity mode at specified +/- percentage """
+    sid, velocity = self.goal_velocity(id, percentage)
+    self.write_data(sid, GOAL_VELOCITY, pack('<i', velocity))
+
+  def set_max_current(self, id, current):
+    sid, center, inverted = self.check_id(id)
+    self.check_sp()
+    # Does nothing
+
+  def init_velocity(self, id):
+    sid, center, inverted = self.check_id(id)
+    self.check_sp()
+    self.set_mode(sid, VELOCITY_MODE)
+
+  def velocity(self, id, pct_velocity):
+    """
+    Runs the specified servo in velocity mode at specified velocity, the
+    same as power_percent.
+    """
+    self.power_percent(id, pct_velocity)
+
+  def init_angle(self, id):
+    sid, center, inverted = self.check_id(id)
+    self.check_sp()
+    self.set_mode(sid, POSITION_MODE)
+
+  def maxangle(self, id):
+    sid, center, inverted = self.check_id(id)
+    self.check_sp()
+    return 150
+
+  def angle(self, id, angle):
+    sid, position = self.goal_position(id, angle)
+    self.write_data(sid, GOAL_POSITION, pack('<i', position))
+
+  def apply_batch(self, velocities, angles):
+    """
+    Set goal position of every steering servo in one SYNC_WRITE packet, and
+    goal velocity of every wheel servo in another. If sync_write is turned
+    off, one WRITE per servo instead.
+    """
+    if not self.use_sync_write:
+      for id, angle in angles:
+        self.angle(id, angle)
+      for id, velocity in velocities:
+        self.velocity(id, velocity)
+      return
+
+    if angles:
+      positions = [self.goal_position(id, angle) for id, angle in angles]
+      self.sync_write(GOAL_POSITION, 4, [(sid, bytearray(pack('<i', position))) for sid, position in positions])
+
+    if velocities:
+      goals = [self.goal_velocity(id, velocity) for id, velocity in velocities]
+      self.sync_write(GOAL_VELOCITY, 4, [(sid, bytearray(pack('<i', goal))) for sid, goal in goals])
+
+  def steer_setzero(self, id):
+    sid, center, inverted = self.check_id(id)
+    self.check_sp()
+    # TODO: Support live adjustment
+
+  def input_voltage(self, id):
+    """
+    Query Dynamixel servo's internal voltage monitor
+    """
+    sid, center, inverted = self.check_id(id)
+    self.check_sp()
+
+    params = self.read_data(sid, PRESENT_INPUT_VOLTAGE, 2)
+    return unpack('<H', bytes(params))[0]/10.0
+
+  def telemetry(self, ids):
+    """
+    Read present current, velocity, position, voltage and temperature of
+    every listed servo in one SYNC_READ or FAST_SYNC_READ. Returns dictionary
+    of servo identifier to sample dictionary, with the same keys as
+    dynamixel_wrapper.telemetry() except current (raw units) instead of load.
+    Servos that stopped answering, fail to reply, or never answer reads
+    (status return level zero) are left out.
+    """
+    self.check_sp()
+    ids = [self.check_id(id) for id in ids]
+    ids = [id for id in ids if self.status_levels.get(id[0]) != 0]
+    samples = dict()
+    if not ids:
+      return samples
+
+    servos = dict((id[0], id) for id in ids)
+    results = self.sync_read(PRESENT_CURRENT, telemetry_block.size, [id[0] for id in ids])
+    for sid, err, data in results:
+      id = servos[sid]
+      current, velocity, position, vtrajectory, ptrajectory, voltage, temperature = telemetry_block.unpack(bytes(data))
+      sample = {
+        'position': position,
+        'angle': (position - 2048) * 360 / 4096.0,
+        'velocity': velocity * 100.0 / self.max_velocity,
+        'current': current,
+        'voltage': voltage/10.0,
+        'temperature': temperature,
+        'error': err,
+        'time': time.time()}
+
+      if id[2]:
+        for key in ('angle', 'velocity', 'current'):
+          sample[key] = -sample[key]
+
+      self.health[sid] = dict((key, sample[key]) for key in ('error', 'voltage', 'temperature', 'time'))
+      samples[id] = sample
+
+    return samples
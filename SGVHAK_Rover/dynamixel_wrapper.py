@@ -21,10 +21,20 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
+import logging
 import serial
+import time
 from struct import *
 
 import configuration
+import device_health
+import frame_parser
+
+# Status Return Level (control table address 16) values: when a servo sends
+# a status packet in response to an instruction.
+status_return_none = 0  # Only respond to PING
+status_return_read = 1  # Only respond to PING and READ_DATA
+status_return_all = 2   # Respond to everything, factory default
 
 def bytetohex(bytearray):
   """
@@ -39,9 +49,47 @@ class dynamixel_wrapper:
   Class that implements the rover motor control methods for Dynamixel serial
   bus servo by Robotis. Specifically the model AX-12A.
   """
+
+  # Deadbands and refresh interval used by roverchassis.roverwheel to skip
+  # sending commands that would not change anything.
+  # Goal position is about 3.4 counts per degree, moving speed 1023 counts
+  # for 100 percent. SYNC_WRITE gets no status reply, so a lost packet would
+  # go unnoticed: values are sent again every refresh_interval seconds. If
+  # configured to write servos one at a time instead, at a status return
+  # level where writes return status, connect() turns the refresh off.
+  angle_deadband = 0.25
+  velocity_deadband = 0.1
+  refresh_interval = 2.0
+
   def __init__(self):
     self.sp = None
 
+    # Reassembles status packets from whatever bytes have arrived.
+    self.parser = frame_parser.dynamixel_parser()
+
+    # Reply time of each servo, to wait only as long as that servo needs
+    # (at most the configured timeout) and skip servos not answering.
+    self.devicehealth = device_health.device_health("Dynamixel", 0.5)
+    self.senttime = 0
+
+    # Status return level we want servos to use, and level each servo is
+    # known to be at. Servos not yet configured are at factory default.
+    self.status_return_level = status_return_all
+    self.status_levels = dict()
+
+    # Most recent health reading of each servo: dictionary of servo ID to
+    # dictionary with error flags, voltage, temperature and time of reading.
+    # Servos are read one per poll() in turn.
+    self.health = dict()
+    self.healthnext = 0
+
+    # Read telemetry of all servos with one BULK_READ instead of a READ_DATA
+    # per servo. BULK_READ is supported by MX series servos, not AX series.
+    self.bulk_read = False
+
+    # Send batches as SYNC_WRITE instead of a WRITE_DATA per servo.
+    self.use_sync_write = True
+
   def check_sp(self):
     """ Raises error if we haven't opened serial port yet. """
     if self.sp == None:
@@ -55,13 +103,20 @@ class dynamixel_wrapper:
 
     # Read parameter file
     config = configuration.configuration("dynamixel")
-    connectparams = config.load()['connect']
+    allparams = config.load()
+    connectparams = allparams['connect']
+    self.status_return_level = allparams.get('status_return_level', self.status_return_level)
+    self.bulk_read = allparams.get('telemetry', dict()).get('bulk_read', self.bulk_read)
+    self.use_sync_write = allparams.get('sync_write', self.use_sync_write)
+    if not self.use_sync_write and self.status_return_level == status_return_all:
+      self.refresh_interval = None
 
     # Open serial port with parameters
     s = serial.Serial()
     s.baudrate = connectparams['baudrate']
     s.port = connectparams['port']
     s.timeout = connectparams['timeout']
+    self.devicehealth.max_timeout = s.timeout
     s.open()
 
     if s.is_open:
@@ -110,6 +165,8 @@ class dynamixel_wrapper:
     packet_bytes = bytearray(packet)
     # print("Sending command byte stream of {}".format(bytetohex(packet_bytes)))
     self.sp.write(packet_bytes)
+    self.parser.sent(packet_bytes)
+    self.senttime = time.time()
 
   def read_raw(self, length=100):
     """
@@ -119,10 +176,10 @@ class dynamixel_wrapper:
     self.check_sp()
     return bytearray(self.sp.read(length))
 
-  def read_parsed(self, length=100, expectedid=None, expectederr=None, expectedparams=None):
+  def read_parsed(self, expectedid=None, expectederr=None, expectedparams=None):
     """
-    Reads up to 'length' bytes and parse it according to pack format spec
-    from Robotis e-Manual
+    Reads the next packet from serial device, parsed according to pack
+    format spec from Robotis e-Manual
     http://emanual.robotis.com/docs/en/dxl/protocol1/#status-packet
     http://support.robotis.com/en/techsupport_eng.htm#product/actuator/dynamixel/ax_series/dxl_ax_actuator.htm
 
@@ -133,63 +190,252 @@ class dynamixel_wrapper:
     Packet with no parameters has length of 2 bytes, plus header+ID+Length = 6 bytes total.
     Checksum = (~(ID+Length+Err+Param1+...+ParamN)) & 0xFF
 
+    Bytes are handed to the frame parser as they arrive, so this returns as
+    soon as a valid packet is complete. Stray bytes and our own echo are
+    skipped. Only when no packet arrives at all do we wait for the timeout,
+    which is how long the expected servo usually takes to answer.
+
     - -
 
     Optional parameters:
       expectedid = if provided, will check message ID against expected ID.
-      expectedcmd = if provided, will check message command against expected command.
+      expectederr = if provided, will check message error against expected error.
       expectedparams = if provided, will check the number of bytes in parameter matches expected.
 
       If a mismatch is found, a ValueError is raised.
     """
     self.check_sp()
-    r = bytearray(self.sp.read(length))
-
-    # Check response length
-    if len(r) < 6:
-      raise ValueError("Need at least 6 bytes for a valid packet, received {}".format(len(r)))
-
-    # Check header
-    if r[0] != 0xFF or r[1] != 0xFF:
-      raise ValueError("Response header is {:02x} {:02x}, expected 0xFF 0xFF".format(r[0], r[1]))
-
-    # Verify length
-    rlen = r[3]
-    if rlen+4 != len(r):
-      raise ValueError("Packet claims to have {} bytes of data + 4 bytes of header, but we retrieved {} bytes.".format(rlen, len(r)))
+    if expectedid is None:
+      packet = self.parser.read(self.sp)
+    else:
+      packet = self.parser.read(self.sp, self.devicehealth.timeout(expectedid))
+      if packet is None:
+        self.devicehealth.failure(expectedid)
+      elif packet[0] == expectedid:
+        self.devicehealth.success(expectedid, time.time() - self.senttime)
+    if packet is None:
+      raise ValueError("No valid packet received before timeout")
 
-    # Verify checksum
-    checksum = 0
-    for b in r[2:-1]:
-      checksum = checksum + b
-    checksum = (~checksum) & 0xFF
+    return self.check_packet(packet, expectedid, expectederr, expectedparams)
 
-    if checksum != r[-1]:
-      raise ValueError("Packet checksum {} does not match calculated checksum {}".format(r[-1], checksum))
+  def check_packet(self, packet, expectedid=None, expectederr=None, expectedparams=None):
+    """
+    Validate a status packet tuple from the frame parser against expected
+    values. See read_parsed() for details.
+    """
+    (rid, rerr, rparams) = packet
 
     # If an expected ID is given, compare against ID in the message.
-    rid = r[2]
     if expectedid != None and expectedid != rid:
       raise ValueError("Response stamped with ID {}, expected {}".format(rid, expectedid))
 
     # If an expected error is given, compare against error in the message.
-    rerr = r[4]
     if expectederr != None and expectederr != rerr:
       raise ValueError("Response error {}, expected {}".format(rerr, expectederr))
 
     # Examine parameters, if any.
-    if rlen > 2:
-      rparams = bytearray(r[5:-1])
+    if rparams:
       if expectedparams and expectedparams != len(rparams):
         raise ValueError("Received {} bytes of parameters, expected {}".format(len(rparams),expectedparams))
     else:
-      rparams = None
-      if expectedparams and expectedparams != 0:
-        raise ValueError("Received {} bytes of parameters, expected none".format(len(rparams)))
+      if expectedparams:
+        raise ValueError("Received no parameters, expected {} bytes".format(expectedparams))
 
     # Return results in a tuple
     return (rid, rerr, rparams)
 
+  def check_answering(self, sid):
+    """
+    Raises error instead of sending a read to a servo that stopped
+    answering, see device_health.
+    """
+    if self.devicehealth.skip(sid):
+      raise ValueError("Dynamixel servo {} is not answering".format(sid))
+
+  def write_data(self, sid, data):
+    """
+    WRITE_DATA (instruction 3) to a servo. Waits for the status packet only
+    if the servo is configured to send one for writes, otherwise returns
+    right away. Errors on servos that don't reply to writes are caught by
+    the health readings of poll().
+    """
+    self.send(sid, 3, data)
+    if self.status_levels.get(sid, status_return_all) == status_return_all and not self.devicehealth.skip(sid):
+      self.read_parsed(expectedid=sid, expectederr=0, expectedparams=0)
+
+  def set_status_return_level(self, sid):
+    """
+    Set servo's status return level to configured value, unless already
+    done. Whether the write itself gets a status reply is uncertain while
+    the level changes, so read the value back and allow for a write status
+    packet to arrive ahead of the read reply. At level zero reads get no
+    reply either, so it can't be read back and the write is trusted.
+    """
+    level = self.status_return_level
+    if self.status_levels.get(sid) == level:
+      return
+
+    self.check_answering(sid)
+    if level == status_return_none:
+      self.send(sid, 3, (16, level))
+      if self.status_levels.get(sid, status_return_all) == status_return_all:
+        # Servo still answers this write at its old level, don't leave the
+        # status packet behind for the next read.
+        self.parser.read(self.sp, self.devicehealth.timeout(sid))
+      self.status_levels[sid] = level
+      return
+
+    self.send(sid, 3, (16, level))
+    self.send(sid, 2, (16, 1))
+
+    (rid, err, params) = self.read_parsed(expectedid=sid)
+    if params is None:
+      # Status packet for the write came first.
+      (rid, err, params) = self.read_parsed(expectedid=sid)
+    self.check_packet((rid, err, params), expectedid=sid, expectederr=0, expectedparams=1)
+
+    if params[0] != level:
+      raise ValueError("Servo {} status return level is {} after setting it to {}".format(sid, params[0], level))
+    self.status_levels[sid] = level
+
+  def read_status_return_level(self, sid):
+    """
+    Read servo's current status return level, so writes know whether to
+    wait for a status packet.
+    """
+    self.check_answering(sid)
+    self.send(sid, 2, (16, 1))
+    (rid, err, params) = self.read_parsed(expectedid=sid, expectedparams=1)
+    self.status_levels[sid] = params[0]
+    return params[0]
+
+  def read_health(self, sid):
+    """
+    Read error flags, voltage and temperature of a servo. READ_DATA always
+    gets a status packet (unless status return level is zero) whose error
+    byte reports any problem from previous instructions.
+    """
+    self.check_answering(sid)
+    self.sp.reset_input_buffer()
+    self.parser.reset()
+    self.send(sid, 2, (42, 2))
+    (rid, err, params) = self.read_parsed(expectedid=sid, expectedparams=2)
+
+    if err != 0:
+      logging.getLogger(__name__).error("Dynamixel servo {} reports error flags {:02x}".format(sid, err))
+
+    self.health[sid] = {
+      'error': err,
+      'voltage': params[0]/10.0,
+      'temperature': params[1],
+      'time': time.time()}
+    return self.health[sid]
+
+  @staticmethod
+  def signed_percent(value):
+    """
+    Present speed and present load registers hold 0-1023 magnitude with bit
+    10 set for clockwise. Returns that as +/- percentage, clockwise
+    positive same as power_percent().
+    """
+    pct = (value & 0x3ff) * 100 / 1023.0
+    if value & 0x400:
+      return pct
+    else:
+      return -pct
+
+  def telemetry_sample(self, id, err, params):
+    """
+    Convert the eight byte block from present position (address 36)
+    through present temperature (address 43) into a dictionary. Angle is
+    in degrees off center like angle(), velocity and load in percent like
+    velocity(), both taking inversion into account.
+    """
+    sid, center, inverted = id
+    position, speed, load, voltage, temperature = unpack('=HHHBB', bytes(params))
+
+    sample = {
+      'position': position,
+      'angle': (position - 512) * 150 / 511.0,
+      'velocity': self.signed_percent(speed),
+      'load': self.signed_percent(load),
+      'voltage': voltage/10.0,
+      'temperature': temperature,
+      'error': err,
+      'time': time.time()}
+
+    if inverted:
+      for key in ('angle', 'velocity', 'load'):
+        sample[key] = -sample[key]
+
+    self.health[sid] = dict((key, sample[key]) for key in ('error', 'voltage', 'temperature', 'time'))
+
+    return sample
+
+  def telemetry(self, ids):
+    """
+    Read present position, speed, load, voltage and temperature of every
+    listed servo. Each servo's registers are one contiguous block read by
+    a single READ_DATA, or all servos with one BULK_READ if configured.
+    Servos that stopped answering or never answer reads (status return
+    level zero) are left out, and one that fails to answer doesn't keep
+    the others from being read.
+    Returns dictionary of servo identifier to sample dictionary, see
+    telemetry_sample().
+    """
+    self.check_sp()
+    ids = [self.check_id(id) for id in ids]
+    ids = [id for id in ids if self.status_levels.get(id[0]) != status_return_none]
+    ids = [id for id in ids if not self.devicehealth.skip(id[0])]
+    samples = dict()
+    if not ids:
+      return samples
+
+    self.sp.reset_input_buffer()
+    self.parser.reset()
+    if self.bulk_read:
+      data = bytearray([0])
+      for sid, center, inverted in ids:
+        data.extend((8, sid, 36))
+      self.send(0xfe, 0x92, data)
+      for id in ids:
+        try:
+          (rid, err, params) = self.read_parsed(expectedid=id[0], expectedparams=8)
+        except ValueError as e:
+          # Each servo replies after the one before it, so nothing more
+          # is coming.
+          logging.getLogger(__name__).debug(str(e))
+          break
+        samples[id] = self.telemetry_sample(id, err, params)
+    else:
+      for id in ids:
+        self.send(id[0], 2, (36, 8))
+        try:
+          (rid, err, params) = self.read_parsed(expectedid=id[0], expectedparams=8)
+        except ValueError as e:
+          logging.getLogger(__name__).debug(str(e))
+          continue
+        samples[id] = self.telemetry_sample(id, err, params)
+
+    return samples
+
+  def poll(self):
+    """
+    Called periodically by the chassis. Reads health of one servo in turn.
+    """
+    servos = sorted(sid for sid, level in self.status_levels.items() if level != status_return_none)
+    if not servos:
+      return
+
+    self.healthnext = self.healthnext % len(servos)
+    sid = servos[self.healthnext]
+    self.healthnext = self.healthnext + 1
+    try:
+      self.read_health(sid)
+    except ValueError as e:
+      # Servos that stop answering are reported by devicehealth.
+      logging.getLogger(__name__).debug(str(e))
+
   def version(self, id):
     """ Identifier string for this motor controller """
     return "Dynamixel"
@@ -216,6 +462,14 @@ class dynamixel_wrapper:
 
   def power_percent(self, id, percentage):
     """ Runs servo in motor mode at specified +/- percentage """
+    sid, power = self.power_value(id, percentage)
+
+    self.write_data(sid, bytearray(pack('=Bh',32, power)))
+
+  def power_value(self, id, percentage):
+    """
+    Returns (servo ID, moving speed register value) for power_percent()
+    """
     sid, center, inverted = self.check_id(id)
     self.check_sp()
 
@@ -232,8 +486,7 @@ class dynamixel_wrapper:
     if percentage >= 0:
       power = power + 1024
 
-    self.send(sid, 3, bytearray(pack('=Bh',32, power)))
-    self.read_parsed(length=6, expectedid=sid, expectederr=0, expectedparams=0)
+    return (sid, int(power))
 
   def set_max_current(self, id, current):
     sid, center, inverted = self.check_id(id)
@@ -244,8 +497,8 @@ class dynamixel_wrapper:
     sid, center, inverted = self.check_id(id)
     self.check_sp()
 
-    self.send(sid, 3, bytearray(pack('=Bhh',6, 0, 0))) # Make sure we're in wheel mode
-    self.read_parsed(length=6, expectedid=sid, expectederr=0, expectedparams=0)
+    self.set_status_return_level(sid)
+    self.write_data(sid, bytearray(pack('=Bhh',6, 0, 0))) # Make sure we're in wheel mode
 
   def velocity(self,id,pct_velocity):
     """
@@ -261,8 +514,8 @@ class dynamixel_wrapper:
     sid, center, inverted = self.check_id(id)
     self.check_sp()
 
-    self.send(sid, 3, bytearray(pack('=Bhh',6, 0, 1023))) # Make sure we're in joint mode
-    self.read_parsed(length=6, expectedid=sid, expectederr=0, expectedparams=0)
+    self.set_status_return_level(sid)
+    self.write_data(sid, bytearray(pack('=Bhh',6, 0, 1023))) # Make sure we're in joint mode
 
   def maxangle(self, id):
     sid, center, inverted = self.check_id(id)
@@ -270,6 +523,14 @@ class dynamixel_wrapper:
     return 150
 
   def angle(self, id, angle):
+    sid, position = self.angle_position(id, angle)
+
+    self.write_data(sid, bytearray(pack('=Bhh',30, position, 0)))
+
+  def angle_position(self, id, angle):
+    """
+    Returns (servo ID, goal position register value) for angle()
+    """
     sid, center, inverted = self.check_id(id)
     self.check_sp()
 
@@ -281,8 +542,47 @@ class dynamixel_wrapper:
 
     delta = 512 + 511*(angle/150.0) # 512 count/ 150 degrees = counts per degree.
 
-    self.send(sid, 3, bytearray(pack('=Bhh',30, delta, 0)))
-    self.read_parsed(length=6, expectedid=sid, expectederr=0, expectedparams=0)
+    return (sid, int(delta))
+
+  def sync_write(self, address, length, items):
+    """
+    Write 'length' bytes starting at control table 'address' on several
+    servos with a single SYNC_WRITE (0x83) broadcast packet. Items is a
+    list of (servo ID, data bytes). Broadcasts get no status reply.
+    """
+    data = bytearray([address, length])
+    for sid, values in items:
+      if len(values) != length:
+        raise ValueError("Servo {} sync write of {} bytes, expected {}".format(sid, len(values), length))
+      data.append(sid)
+      data.extend(values)
+
+    if len(data) + 2 > 0xff:
+      raise ValueError("Sync write of {} servos does not fit in one packet".format(len(items)))
+
+    self.send(0xfe, 0x83, data)
+
+  def apply_batch(self, velocities, angles):
+    """
+    Set goal position (with moving speed) of every steering servo in one
+    SYNC_WRITE packet, and moving speed of every wheel servo in another,
+    instead of one write and status reply per servo. Unless sync_write is
+    turned off, then it is one write per servo after all.
+    """
+    if not self.use_sync_write:
+      for id, angle in angles:
+        self.angle(id, angle)
+      for id, velocity in velocities:
+        self.velocity(id, velocity)
+      return
+
+    if angles:
+      positions = [self.angle_position(id, angle) for id, angle in angles]
+      self.sync_write(30, 4, [(sid, bytearray(pack('=hh', position, 0))) for sid, position in positions])
+
+    if velocities:
+      powers = [self.power_value(id, velocity) for id, velocity in velocities]
+      self.sync_write(32, 2, [(sid, bytearray(pack('=h', power))) for sid, power in powers])
 
   def steer_setzero(self, id):
     sid, center, inverted = self.check_id(id)
@@ -296,8 +596,9 @@ class dynamixel_wrapper:
     sid, center, inverted = self.check_id(id)
     self.check_sp()
 
+    self.check_answering(sid)
     self.send(sid, 2, (42,1))
-    (sid, err, params) = self.read_parsed(length=7,expectedid=sid, expectederr=0, expectedparams=1)
+    (sid, err, params) = self.read_parsed(expectedid=sid, expectederr=0, expectedparams=1)
     voltage = params[0]
 
     return voltage/10.0
@@ -332,6 +633,12 @@ if __name__ == "__main__":
   c = dynamixel_wrapper()
   c.connect()
 
+  if not args.queryid:
+    try:
+      c.read_status_return_level(args.id)
+    except ValueError:
+      pass # Not answering reads, assume factory default.
+
   if args.move != None: # Explicit check against None because zero is a valid value
     if args.move < 0 or args.move > 1023:
       print("Servo move destination {} is outside valid range of 0 to 1023 (1023 = 300 degrees)".format(args.move))
@@ -343,19 +650,17 @@ if __name__ == "__main__":
       else:
         speedarg = "controlled speed {}".format(args.speed)
       print("Moving servo {} to position {} at {}".format(args.id, args.move, speedarg))
-      c.send(args.id, 3, bytearray(pack('=Bhh',6, 0, 1023))) # Make sure we're in joint mode
-      c.read_parsed(length=6, expectedid=args.id, expectederr=0, expectedparams=0)
-      c.send(args.id, 3, bytearray(pack('=Bhh',30, args.move, args.speed)))
-      c.read_parsed(length=6, expectedid=args.id, expectederr=0, expectedparams=0)
+      c.write_data(args.id, bytearray(pack('=Bhh',6, 0, 1023))) # Make sure we're in joint mode
+      c.write_data(args.id, bytearray(pack('=Bhh',30, args.move, args.speed)))
   elif args.queryid:
     print("Broadcasting servo ID query")
     c.send(0xfe, 1) # Broadcast and ask to report ID
-    (sid, err, params) = c.read_parsed(length=6, expectederr=0, expectedparams=0)
+    (sid, err, params) = c.read_parsed(expectederr=0, expectedparams=0)
     print("Servo ID {} responded to query".format(sid))
   elif args.rename:
     print("Checking the specified servo ID {} is on the serial network.".format(args.id))
     c.send(args.id, 1) # Ask for current servo ID
-    (sid, err, params) = c.read_parsed(length=6, expectederr=0, expectedparams=0)
+    (sid, err, params) = c.read_parsed(expectederr=0, expectedparams=0)
     if sid != args.id:
       print("Unexpected answer from servo {} when verifying servo {} is on the network.".format(sid, args.id))
     else:
@@ -366,11 +671,10 @@ if __name__ == "__main__":
         raise ValueError("Someone answers to servo ID {} on the network, rename aborted.".format(args.rename))
       else:
         print("Renaming servo ID {} to {}".format(args.id, args.rename))
-        c.send(args.id, 3, bytearray(pack('=BB', 3,args.rename)))
-        c.read_parsed(length=6, expectedid=args.id, expectederr=0, expectedparams=0)
+        c.write_data(args.id, bytearray(pack('=BB', 3,args.rename)))
         print("Verifying the servo now answers to new ID")
         c.send(args.rename, 1)
-        (sid, cmd, params) = c.read_parsed(length=6, expectederr=0, expectedparams=0)
+        (sid, cmd, params) = c.read_parsed(expectederr=0, expectedparams=0)
         if sid != args.rename:
           print("Querying for response from ID {} failed, we got answer from ID {}/{} instead.".format(args.rename, sid))
         else:
@@ -380,26 +684,23 @@ if __name__ == "__main__":
       print("Servo spin speed {} is outside valid range of 0 to 2047".format(args.spin))
     else:
       print("Spinning motor of servo {} at speed {}".format(args.id, args.spin))
-      c.send(args.id, 3, bytearray(pack('=Bhh',6, 0, 0))) # Make sure we're in wheel mode
-      c.read_parsed(length=6, expectedid=args.id, expectederr=0, expectedparams=0)
-      c.send(args.id, 3, bytearray(pack('=Bh',32, args.spin)))
-      c.read_parsed(length=6, expectedid=args.id, expectederr=0, expectedparams=0)
+      c.write_data(args.id, bytearray(pack('=Bhh',6, 0, 0))) # Make sure we're in wheel mode
+      c.write_data(args.id, bytearray(pack('=Bh',32, args.spin)))
   elif args.unload:
     print("Unloading servo ID {}".format(args.id))
-    c.send(args.id, 3, (24,0))
-    c.read_parsed(length=6, expectedid=args.id, expectederr=0, expectedparams=0)
+    c.write_data(args.id, (24,0))
   elif args.reset:
     print("Reset servo ID {} to factory defaults".format(args.id))
     c.send(args.id, 6, None)
     print(bytetohex(c.read_raw()))
   elif args.voltage:
     c.send(args.id, 2, (42,1))
-    (sid, err, params) = c.read_parsed(length=7, expectedid=args.id, expectederr=0, expectedparams=1)
+    (sid, err, params) = c.read_parsed(expectedid=args.id, expectederr=0, expectedparams=1)
     voltage = params[0]
     print("Servo {} reports input voltage of {}".format(sid, voltage/10.0))
   elif args.location:
     c.send(args.id, 2, (36,2))
-    (sid, err, params) = c.read_parsed(length=8, expectedid=args.id)
+    (sid, err, params) = c.read_parsed(expectedid=args.id)
     position=unpack('h',params)[0]
     print("Servo current locaton {} with err {}".format(position, err))
   else:
@@ -0,0 +1,177 @@
+"""
+MIT License
+
+Copyright (c) 2018 Roger Cheng
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import time
+from collections import deque
+
+class frame_parser:
+  """
+  Incremental parser for the serial bus servo packet formats, which share
+  a layout of two header bytes, ID, length, a command (or error) byte,
+  parameters, then a checksum of (~(ID+Length+Byte4+Param1+...+ParamN)).
+  Bytes are fed in as they arrive from the serial port, in whatever size
+  chunks are available, and complete packets are returned as soon as the
+  last byte shows up. There is no need to know how long a reply will be
+  before reading it.
+
+  Anything that does not look like a valid packet (stray bytes, a bad
+  length or checksum) is skipped one byte at a time until the next header.
+  On buses wired so we hear our own transmissions, the echo of the last
+  packets most recently sent are dropped as well.
+
+  Subclasses fill in the header and how the length byte is counted.
+  """
+
+  header = None
+
+  # Bytes of packet not counted by the length byte.
+  overhead = 0
+
+  # Range of valid values for the length byte.
+  min_length = 0
+  max_length = 0
+
+  # Values in the ID position that can't be the start of a real packet.
+  invalid_ids = ()
+
+  def __init__(self):
+    self.buffer = bytearray()
+    self.echoes = deque(maxlen=4)
+
+  def reset(self):
+    """ Discard everything received so far """
+    del self.buffer[:]
+    self.echoes.clear()
+
+  def feed(self, data):
+    """ Append bytes received from serial port """
+    self.buffer.extend(data)
+
+  def sent(self, packet):
+    """ Note a packet we've just sent, so its echo can be recognized. """
+    self.echoes.append(bytearray(packet))
+
+  def frame(self):
+    """
+    Returns the next complete and valid packet as a tuple of
+    (id, command or error, parameters) or None if there isn't one yet.
+    Parameters is None for a packet without any.
+    """
+    buf = self.buffer
+    while True:
+      start = buf.find(self.header)
+      if start < 0:
+        # Keep a trailing byte, it might be the first half of a header.
+        del buf[:max(0, len(buf)-1)]
+        return None
+      del buf[:start]
+
+      if len(buf) < 4:
+        return None
+      length = buf[3]
+      if buf[2] in self.invalid_ids or length < self.min_length or length > self.max_length:
+        del buf[0]
+        continue
+      end = length + self.overhead
+      if len(buf) < end:
+        return None
+
+      checksum = (~sum(buf[2:end-1])) & 0xFF
+      if checksum != buf[end-1]:
+        del buf[0]
+        continue
+
+      if buf[:end] in self.echoes:
+        self.echoes.remove(buf[:end])
+        del buf[:end]
+        continue
+
+      rid = buf[2]
+      rbyte = buf[4]
+      if end > 6:
+        rparams = bytearray(buf[5:end-1])
+      else:
+        rparams = None
+      del buf[:end]
+      return (rid, rbyte, rparams)
+
+  def read(self, sp, timeout=None):
+    """
+    Read from serial port until a complete packet arrives, and return it as
+    per frame(). Reads whatever is waiting instead of a fixed length, so it
+    returns as soon as the packet is received. Returns None if no packet
+    arrived within timeout, which defaults to the port's timeout.
+    """
+    porttimeout = sp.timeout
+    if timeout is None:
+      timeout = porttimeout
+    deadline = time.time() + timeout
+
+    packet = self.frame()
+    try:
+      while packet is None:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          return None
+        if timeout != porttimeout:
+          sp.timeout = remaining
+        self.feed(sp.read(max(1, sp.in_waiting)))
+        packet = self.frame()
+    finally:
+      if sp.timeout != porttimeout:
+        sp.timeout = porttimeout
+    return packet
+
+class lewansoul_parser(frame_parser):
+  """
+  LewanSoul serial bus servo packets, from "LewanSoul Bus servo
+  Communication Protocol" PDF:
+
+  0     1     2     3     4     [ ... ]
+  0x55  0x55  ID    Len   Cmd   Param1... ParamN  Checksum
+
+  Length counts everything after ID. Nothing in the protocol has more than
+  seven bytes of parameters.
+  """
+  header = bytearray([0x55, 0x55])
+  overhead = 3
+  min_length = 3
+  max_length = 10
+
+class dynamixel_parser(frame_parser):
+  """
+  Dynamixel Protocol 1.0 packets, from Robotis e-Manual
+  http://emanual.robotis.com/docs/en/dxl/protocol1/#status-packet
+
+  0     1     2     3     4     [ ... ]
+  0xFF  0xFF  ID    Len   Err   Param1... ParamN  Checksum
+
+  Length counts error (or instruction) byte, parameters and checksum. ID
+  0xFF is never valid, so a run of 0xFF is skipped until the real header.
+  Nothing reads more than the AX series control table of 50 bytes.
+  """
+  header = bytearray([0xFF, 0xFF])
+  overhead = 4
+  min_length = 2
+  max_length = 52
+  invalid_ids = (0xFF,)
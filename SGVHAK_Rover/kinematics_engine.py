@@ -0,0 +1,96 @@
+"""
+MIT License
+
+Copyright (c) 2018 Roger Cheng
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import numpy
+
+class kinematics_engine:
+  """
+  Array-backed version of the wheel angle and velocity calculation in
+  roverchassis.chassis.exact_angle_velocity(). Wheel coordinates are kept
+  in NumPy arrays so all wheels are calculated at once, and so are many
+  (velocity, radius) samples in a single call. Useful for trajectory
+  previews and offline planning that would otherwise loop over thousands
+  of commands.
+
+  Results must match the per-wheel reference implementation, which
+  remains the authority on rover kinematics.
+  """
+  def __init__(self, wheels, minRadius, maxRadius):
+    # Wheels in a fixed order, that order is used for columns of results.
+    self.names = [wheel.name for wheel in wheels]
+    self.x = numpy.array([wheel.x for wheel in wheels], dtype=float)
+    self.y = numpy.array([wheel.y for wheel in wheels], dtype=float)
+
+    self.minRadius = minRadius
+    self.maxRadius = maxRadius
+
+  def angle_velocity(self, velocities, radii):
+    """
+    Given arrays of velocity and turning radius relative to rover center,
+    calculate the angle and velocity for every wheel.
+
+    Returns a tuple of two arrays (angles, velocities) each with one row per
+    sample and one column per wheel, in the order listed in self.names.
+    """
+    velocity = numpy.asarray(velocities, dtype=float).reshape(-1, 1)
+    radius = numpy.asarray(radii, dtype=float).reshape(-1, 1)
+
+    if velocity.shape != radius.shape:
+      raise ValueError("Need same number of velocity and radius values, got {} and {}".format(
+        velocity.shape[0], radius.shape[0]))
+
+    if numpy.any(numpy.abs(radius) < self.minRadius):
+      raise ValueError("Radius below minimum")
+
+    if numpy.any(numpy.abs(velocity) > 100):
+      raise ValueError("Velocity percentage may not exceed 100")
+
+    # Infinite radius (straight line) and zero-length triangles produce
+    # intermediate inf/nan values that are replaced below. Silence the
+    # warnings about them.
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+      # Dimensions of triangle representing each wheel, one row per sample.
+      opp = self.y
+      adj = radius - self.x
+      hyp = numpy.sqrt(opp*opp + adj*adj)
+
+      angle = numpy.where(adj == 0, 90.0, numpy.degrees(numpy.arctan(opp/adj)))
+      wheelvelocity = velocity * hyp/numpy.abs(radius)
+
+    # Wheels that need to roll backwards because center of rotation is
+    # between them and the origin.
+    reverse = ((radius < 0) & (self.x < 0) & (self.x < radius)) | ((radius > 0) & (self.x > 0) & (self.x > radius))
+    wheelvelocity = numpy.where(reverse, -wheelvelocity, wheelvelocity)
+
+    # Straight line travel
+    straight = radius > self.maxRadius
+    angle = numpy.where(straight, 0.0, angle)
+    wheelvelocity = numpy.where(straight, velocity, wheelvelocity)
+
+    # Normalize so no wheel exceeds target velocity, keeping relative ratios.
+    maxCalculated = numpy.abs(wheelvelocity).max(axis=1).reshape(-1, 1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+      reductionRatio = numpy.abs(velocity)/maxCalculated
+    wheelvelocity = numpy.where(maxCalculated > velocity, wheelvelocity*reductionRatio, wheelvelocity)
+
+    return (angle, wheelvelocity)
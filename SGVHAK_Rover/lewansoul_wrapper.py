@@ -21,10 +21,15 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
+import logging
 import serial
+import time
+from collections import deque
 from struct import *
 
 import configuration
+import device_health
+import frame_parser
 
 def bytetohex(bytearray):
   """
@@ -39,9 +44,50 @@ class lewansoul_wrapper:
   Class that implements the rover motor control methods for serial bus
   servo by LewanSoul. Specifically their model LX-16A.
   """
+
+  # Deadbands and refresh interval used by roverchassis.roverwheel to skip
+  # sending commands that would not change anything.
+  # Position is about 4.2 counts per degree, motor mode speed 10 counts per
+  # percent. Servo commands are not acknowledged, so refresh every now and
+  # then in case a packet was lost on the bus.
+  angle_deadband = 0.2
+  velocity_deadband = 0.1
+  refresh_interval = 2.0
+
+  # Servo operating modes as set by command 29 (SERVO_OR_MOTOR_MODE_WRITE)
+  servo_mode = 0
+  motor_mode = 1
+
   def __init__(self):
     self.sp = None
 
+    # Last known state of each servo, keyed by servo ID: a list of
+    # [mode, position target, motor speed, time record was started].
+    # Used to skip mode switches and targets the servo already has. Since
+    # nothing is acknowledged, a record is only trusted for
+    # refresh_interval seconds before everything is sent again.
+    self.servos = dict()
+
+    # Reassembles reply packets from whatever bytes have arrived.
+    self.parser = frame_parser.lewansoul_parser()
+
+    # Reply time of each servo, to wait only as long as that servo needs
+    # (at most the configured timeout) and skip servos not answering.
+    self.devicehealth = device_health.device_health("LewanSoul", 0.5)
+
+    # Latest telemetry sample of each servo, keyed by servo ID.
+    self.samples = dict()
+    # Telemetry queries (servo identifier, command) waiting their turn.
+    self.queries = deque()
+    # When temperature and voltage were last queued for each servo ID.
+    self.slowqueued = dict()
+    # Running average of seconds per telemetry query and reply.
+    self.querytime = 0.005
+    # Seconds of bus time each telemetry() call may take, and how often
+    # temperature and voltage (which change slowly) are read.
+    self.telemetry_budget = 0.02
+    self.slow_interval = 5.0
+
   def check_sp(self):
     """ Raises error if we haven't opened serial port yet. """
     if self.sp == None:
@@ -55,7 +101,12 @@ class lewansoul_wrapper:
 
     # Read parameter file
     config = configuration.configuration("lewansoul")
-    connectparams = config.load()['connect']
+    allparams = config.load()
+    connectparams = allparams['connect']
+
+    telemetryparams = allparams.get('telemetry', dict())
+    self.telemetry_budget = telemetryparams.get('budget', self.telemetry_budget)
+    self.slow_interval = telemetryparams.get('slow_interval', self.slow_interval)
 
     # Open serial port with parameters
     s = serial.Serial()
@@ -63,6 +114,7 @@ class lewansoul_wrapper:
     s.port = connectparams['port']
     s.timeout = connectparams['timeout']
     s.open()
+    self.devicehealth.max_timeout = s.timeout
 
     if s.is_open:
       self.sp = s
@@ -110,6 +162,7 @@ class lewansoul_wrapper:
     packet_bytes = bytearray(packet)
     # print("Sending command byte stream of {}".format(bytetohex(packet_bytes)))
     self.sp.write(packet_bytes)
+    self.parser.sent(packet_bytes)
 
   def read_raw(self, length=100):
     """
@@ -119,10 +172,10 @@ class lewansoul_wrapper:
     self.check_sp()
     return bytearray(self.sp.read(length))
 
-  def read_parsed(self, length=100, expectedid=None, expectedcmd=None, expectedparams=None):
+  def read_parsed(self, expectedid=None, expectedcmd=None, expectedparams=None):
     """
-    Reads up to 'length' bytes and parse it according to pack format spec
-    from "LewanSoul Bus servo Communication Protocol" PDF:
+    Reads the next packet from serial device, parsed according to pack
+    format spec from "LewanSoul Bus servo Communication Protocol" PDF:
 
     0     1     2     3     4     [ ... ]
     0x55  0x55  ID    Len   Cmd   Param1... ParamN  Checksum
@@ -131,6 +184,10 @@ class lewansoul_wrapper:
     Packet with no parameters has length of 3 bytes, plus header+ID = 6 bytes total.
     Checksum = (~(ID+Length+Cmd+Param1+...+ParamN)) & 0xFF
 
+    Bytes are handed to the frame parser as they arrive, so this returns as
+    soon as a valid packet is complete. Stray bytes and our own echo are
+    skipped. Only when no packet arrives at all do we wait for the timeout.
+
     - -
 
     Optional parameters:
@@ -141,53 +198,164 @@ class lewansoul_wrapper:
       If a mismatch is found, a ValueError is raised.
     """
     self.check_sp()
-    r = bytearray(self.sp.read(length))
-
-    # Check response length
-    if len(r) < 6:
-      raise ValueError("Need at least 6 bytes for a valid packet, received {}".format(len(r)))
-
-    # Check header
-    if r[0] != 0x55 or r[1] != 0x55:
-      raise ValueError("Response header is {:02x} {:02x}, expected 0x55 0x55".format(r[0], r[1]))
-
-    # Verify length
-    rlen = r[3]
-    if rlen+3 != len(r):
-      raise ValueError("Packet claims to have {} bytes of data + 3 bytes of header, but we retrieved {} bytes.".format(rlen, len(r)))
-
-    # Verify checksum
-    checksum = 0
-    for b in r[2:-1]:
-      checksum = checksum + b
-    checksum = (~checksum) & 0xFF
-
-    if checksum != r[-1]:
-      raise ValueError("Packet checksum {} does not match calculated checksum {}".format(r[-1], checksum))
+    packet = self.parser.read(self.sp)
+    if packet is None:
+      raise ValueError("No valid packet received before timeout")
+    (rid, rcmd, rparams) = packet
 
     # If an expected ID is given, compare against ID in the message.
-    rid = r[2]
     if expectedid != None and expectedid != rid:
       raise ValueError("Response stamped with ID {}, expected {}".format(rid, expectedid))
 
     # If an expected command is given, compare against command in the message.
-    rcmd = r[4]
     if expectedcmd != None and expectedcmd != rcmd:
       raise ValueError("Response command {}, expected {}".format(rcmd, expectedcmd))
 
     # Examine parameters, if any.
-    if rlen > 3:
-      rparams = bytearray(r[5:-1])
+    if rparams:
       if expectedparams != None and expectedparams != len(rparams):
         raise ValueError("Received {} bytes of parameters, expected {}".format(len(rparams),expectedparams))
     else:
-      rparams = None
       if expectedparams != None and expectedparams != 0:
-        raise ValueError("Received {} bytes of parameters, expected none".format(len(rparams)))
+        raise ValueError("Received no parameters, expected {} bytes".format(expectedparams))
 
     # Return results in a tuple
     return (rid, rcmd, rparams)
 
+  def servo_state(self, sid):
+    """
+    Returns the state record for the given servo ID, starting a blank one
+    if we have none or the one we have is too old to trust.
+    """
+    now = time.time()
+    state = self.servos.get(sid)
+    if state is None or now - state[3] > self.refresh_interval:
+      state = [None, None, None, now]
+      self.servos[sid] = state
+    return state
+
+  def set_servo_mode(self, sid):
+    """ Put servo into servo (position) mode unless it is already there """
+    state = self.servo_state(sid)
+    if state[0] != self.servo_mode:
+      self.send(sid, 29, (0,0,0,0))
+      state[0] = self.servo_mode
+      state[2] = None
+
+  def set_motor_speed(self, sid, power):
+    """
+    Put servo into motor mode at given speed (-1000 to 1000), unless it is
+    already running in motor mode at that speed.
+    """
+    state = self.servo_state(sid)
+    if state[0] != self.motor_mode or state[2] != power:
+      self.send(sid, 29, bytearray(pack('hh',1,power)))
+      state[0] = self.motor_mode
+      state[1] = None
+      state[2] = power
+
+  def new_position(self, sid, position):
+    """
+    Returns True and records the target if servo was not already told to
+    move to the given position.
+    """
+    state = self.servo_state(sid)
+    if state[1] == position:
+      return False
+    state[1] = position
+    return True
+
+  def query(self, sid, command, expectedparams):
+    """
+    Send a read command to a servo and return parameters of its reply.
+    Replies are picked out of the incoming byte stream by the frame parser
+    as soon as they are complete, anything else received is discarded.
+    Servos that stopped answering are skipped without sending anything.
+    """
+    if self.devicehealth.skip(sid):
+      raise ValueError("Servo {} is not answering".format(sid))
+
+    self.sp.reset_input_buffer()
+    self.parser.reset()
+    self.send(sid, command)
+    start = time.time()
+
+    while True:
+      packet = self.parser.read(self.sp, self.devicehealth.timeout(sid))
+      if packet is None:
+        self.devicehealth.failure(sid)
+        raise ValueError("No reply from servo {} to command {}".format(sid, command))
+      (rid, rcmd, rparams) = packet
+      if rid == sid and rcmd == command and rparams and len(rparams) == expectedparams:
+        self.devicehealth.success(sid, time.time() - start)
+        return rparams
+
+  def read_telemetry(self, id, command):
+    """
+    Run one telemetry query and record its result in the sample for that
+    servo. Position (command 28) is converted to degrees off center like
+    angle(), temperature (26) is in degrees Celsius and voltage (27) in volts.
+    """
+    sid, center, inverted = id
+
+    if command == 28:
+      position = unpack('h', bytes(self.query(sid, 28, 2)))[0]
+      angle = (position - center) * (120.0/500.0)
+      if inverted:
+        angle = angle * -1
+      values = {'position': position, 'angle': angle}
+    elif command == 26:
+      values = {'temperature': self.query(sid, 26, 1)[0]}
+    elif command == 27:
+      values = {'voltage': unpack('h', bytes(self.query(sid, 27, 2)))[0]/1000.0}
+    else:
+      raise ValueError("Command {} is not a telemetry query".format(command))
+
+    sample = self.samples.setdefault(sid, dict())
+    sample.update(values)
+    sample['time'] = time.time()
+
+  def telemetry(self, ids):
+    """
+    Read measured state of listed servos. Each servo answers one query per
+    packet, so queries are worked through a few per call in round-robin:
+    position of servos in servo mode every round, temperature and voltage
+    every slow_interval seconds. The number run per call adapts to measured
+    query time so a call takes about telemetry_budget seconds of bus time,
+    keeping motion commands on the same bus from waiting behind telemetry.
+    Returns dictionary of servo identifier to latest sample dictionary.
+    """
+    self.check_sp()
+    ids = [self.check_id(id) for id in ids]
+
+    if not self.queries:
+      now = time.time()
+      for id in ids:
+        sid = id[0]
+        if sid not in self.servos or self.servos[sid][0] != self.motor_mode:
+          self.queries.append((id, 28))
+        if now - self.slowqueued.get(sid, 0) > self.slow_interval:
+          self.slowqueued[sid] = now
+          self.queries.append((id, 26))
+          self.queries.append((id, 27))
+
+    count = max(1, int(self.telemetry_budget / self.querytime))
+    for i in range(min(count, len(self.queries))):
+      id, command = self.queries.popleft()
+      start = time.time()
+      try:
+        self.read_telemetry(id, command)
+      except ValueError as e:
+        # Servos that stop answering are reported by devicehealth.
+        logging.getLogger(__name__).debug(str(e))
+      self.querytime = self.querytime * 0.875 + (time.time() - start) * 0.125
+
+    samples = dict()
+    for id in ids:
+      if id[0] in self.samples:
+        samples[id] = self.samples[id[0]]
+    return samples
+
   def version(self, id):
     """ Identifier string for this motor controller """
     return "LewanSoul"
@@ -222,12 +390,12 @@ class lewansoul_wrapper:
       raise ValueError("Motor power percentage {0} outside valid range from 0 to 100.".format(pct))
 
     # LewanSoul API wants power expressed between -1000 and 1000, so multiply by 10.
-    power = percentage*10
+    power = int(percentage*10)
 
     if inverted:
       power = power * -1
 
-    self.send(sid, 29, bytearray(pack('hh',1,power)))
+    self.set_motor_speed(sid, power)
 
   def set_max_current(self, id, current):
     """ LewanSoul does not support overpower protection. """
@@ -240,7 +408,8 @@ class lewansoul_wrapper:
     sid, center, inverted = self.check_id(id)
     self.check_sp()
 
-    self.send(sid, 29, bytearray(pack('hh',1,0)))
+    self.servos.pop(sid, None)
+    self.set_motor_speed(sid, 0)
 
   def velocity(self,id,pct_velocity):
     """
@@ -256,7 +425,9 @@ class lewansoul_wrapper:
     sid, center, inverted = self.check_id(id)
     self.check_sp()
 
-    self.send(sid, 29, (0,0,0,0)) # Servo mode
+    self.servos.pop(sid, None)
+    self.set_servo_mode(sid)
+    self.new_position(sid, center)
     self.send(sid, 1, bytearray(pack('hh', center, 2000)))
 
   def maxangle(self, id):
@@ -264,9 +435,12 @@ class lewansoul_wrapper:
     self.check_sp()
     return 120
 
-  def angle(self, id, angle):
+  def angle_position(self, id, angle):
+    """
+    Translate a steering angle into the servo ID and the position count
+    (0-1000) to send to it.
+    """
     sid, center, inverted = self.check_id(id)
-    self.check_sp()
 
     if abs(angle) > 95:
       raise ValueError("Steering angle {} exceeded expected maximum of 90".format(angle))
@@ -276,8 +450,37 @@ class lewansoul_wrapper:
     if inverted:
       delta = delta * -1
 
-    self.send(sid, 29, (0,0,0,0)) # Servo mode
-    self.send(sid, 1, bytearray(pack('hh', center+delta, 200)))
+    return (sid, int(center+delta))
+
+  def angle(self, id, angle):
+    self.check_sp()
+    sid, position = self.angle_position(id, angle)
+
+    self.set_servo_mode(sid)
+    if self.new_position(sid, position):
+      self.send(sid, 1, bytearray(pack('hh', position, 200)))
+
+  def apply_batch(self, velocities, angles):
+    """
+    Preload every steering servo with its target using MOVE_TIME_WAIT_WRITE
+    (command 7) then start them all with a single broadcast MOVE_START
+    (command 11), so all wheels begin steering at the same instant.
+    Wheel velocities have no deferred form and are sent individually.
+    """
+    self.check_sp()
+
+    moves = 0
+    for id, angle in angles:
+      sid, position = self.angle_position(id, angle)
+      self.set_servo_mode(sid)
+      if self.new_position(sid, position):
+        self.send(sid, 7, bytearray(pack('hh', position, 200)))
+        moves = moves + 1
+    if moves:
+      self.send(0xFE, 11)
+
+    for id, velocity in velocities:
+      self.power_percent(id, velocity)
 
   def steer_setzero(self, id):
     sid, center, inverted = self.check_id(id)
@@ -291,9 +494,7 @@ class lewansoul_wrapper:
     sid, center, inverted = self.check_id(id)
     self.check_sp()
 
-    self.send(sid, 27)
-    (sid, cmd, params) = self.read_parsed(length=8, expectedcmd=27, expectedparams=2)
-    millivolts = unpack('h', params)[0]
+    millivolts = unpack('h', bytes(self.query(sid, 27, 2)))[0]
 
     return millivolts/1000.0
 
@@ -337,14 +538,14 @@ if __name__ == "__main__":
   elif args.queryid:
     print("Broadcasting servo ID query")
     c.send(0xfe, 14) # Broadcast and ask to report ID
-    (sid, cmd, params) = c.read_parsed(length=7, expectedcmd=14, expectedparams=1)
+    (sid, cmd, params) = c.read_parsed(expectedcmd=14, expectedparams=1)
     if sid != params[0]:
       raise ValueError("ID response stamped with {} but payload says {}".format(sid, params[0]))
     print("Servo ID {} responded to query".format(sid))
   elif args.rename:
     print("Checking the specified servo ID {} is on the serial network.".format(args.id))
     c.send(args.id, 14) # Ask for current servo ID
-    (sid, cmd, params) = c.read_parsed(length=7, expectedcmd=14, expectedparams=1)
+    (sid, cmd, params) = c.read_parsed(expectedcmd=14, expectedparams=1)
     if sid != args.id or params[0] != args.id:
       print("Unexpected answer from servo {} when verifying servo {} is on the network.".format(sid, args.id))
     else:
@@ -358,7 +559,7 @@ if __name__ == "__main__":
         c.send(args.id, 13, (args.rename,))
         print("Verifying the servo now answers to new ID")
         c.send(args.rename, 14)
-        (sid, cmd, params) = c.read_parsed(length=7, expectedcmd=14, expectedparams=1)
+        (sid, cmd, params) = c.read_parsed(expectedcmd=14, expectedparams=1)
         if sid != args.rename or sid != params[0]:
           print("Querying for response from ID {} failed, we got answer from ID {}/{} instead.".format(args.rename, sid, params[0]))
         else:
@@ -373,7 +574,7 @@ if __name__ == "__main__":
     c.send(args.id, 31, (0,))
   elif args.voltage:
     c.send(args.id, 27)
-    (sid, cmd, params) = c.read_parsed(length=8, expectedcmd=27, expectedparams=2)
+    (sid, cmd, params) = c.read_parsed(expectedcmd=27, expectedparams=2)
     voltage = unpack('h', params)[0]
     print("Servo {} reports input voltage of {}".format(sid, voltage/1000.0))
   else:
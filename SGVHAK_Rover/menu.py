@@ -27,6 +27,17 @@ from SGVHAK_Rover import app, chassis
 from flask import flash, json, redirect, render_template, request, url_for
 import roverchassis
 
+def poll_when_idle():
+  """
+  Poll motor controls for telemetry if nobody else does. Only done through
+  bus workers, which take turns with motion commands on each bus. Without
+  them the reads would run here in the request thread, at the same time as
+  drive commands from other requests on the same serial bus, so pages are
+  served whatever telemetry the control loop last collected.
+  """
+  if chassis.busworkers and not chassis.control_loop:
+    chassis.poll_controls()
+
 class main_menu:
 
   @app.route('/')
@@ -44,8 +55,7 @@ class main_menu:
     Stop motors immediately
     """
     chassis.ensureready()
-    for wheel in chassis.wheels.values():
-      wheel.poweroff()
+    chassis.post_stop()
     flash("Motors Stopped","success")
     return render_template("index.html")
 
@@ -79,11 +89,11 @@ class main_menu:
       return render_template("drive_command.html",
         page_title = 'Velocity & Angle Commands')
     else:
-      # TODO: Limit the frequency of updates to one every 50ms. If more
-      # than one update arrive within the window, use the final one. This
-      # reduces workload on RoboClaw serial network and the mechanical bits
-      # can't respond super fast anyway.
-      # EXCEPTION: If a stop command arrives, stop immediately.
+      # When the chassis motion mailbox is enabled, updates are applied no
+      # faster than its configured rate. If more than one update arrive
+      # within the window, the final one is used. This reduces workload on
+      # motor control serial networks and the mechanical bits can't respond
+      # super fast anyway. Stop commands are applied immediately.
       pct_angle = float(request.form['pct_angle'])
       magnitude = float(request.form['magnitude'])
 
@@ -95,7 +105,7 @@ class main_menu:
         radius = -chassis.minRadius - (chassis.maxRadius-chassis.minRadius) * (100+pct_angle)/100.0
 
       if chassis.use_rc_input == False:
-          chassis.move_velocity_radius(magnitude, radius)
+          chassis.post_motion(magnitude, radius)
 
       return json.jsonify({'Success':1})
 
@@ -180,16 +190,53 @@ class main_menu:
     Return a JSON representation of current chassis wheel status. Use POST
     instead of GET to clearify this data should not be cached.
     Polled regularly by chassis_config.js to update onscreen display of
-    chassis_config.html.
+    chassis_config.html. Includes measured angle and velocity for wheels
+    whose motor controls report telemetry.
     """
     chassis.ensureready()
+    poll_when_idle()
     wheelInfo = dict()
     for name, wheel in chassis.wheels.iteritems():
       wheelInfo[name] = dict()
       wheelInfo[name]['velocity'] = wheel.velocity
       wheelInfo[name]['angle'] = wheel.angle
+
+      # Measured state, where motor control can report it.
+      telemetry = chassis.telemetry.get(name, dict())
+      if 'velocity' in telemetry.get('rolling', dict()):
+        wheelInfo[name]['measured_velocity'] = telemetry['rolling']['velocity']
+      if 'angle' in telemetry.get('steering', dict()):
+        wheelInfo[name]['measured_angle'] = telemetry['steering']['angle']
+      if telemetry:
+        wheelInfo[name]['telemetry'] = telemetry
     return json.jsonify(wheelInfo)
 
+  @app.route('/odometry', methods=['POST'])
+  def odometry_status():
+    """
+    Return a JSON representation of rover position (x, y), heading
+    (degrees counterclockwise), and velocity (vx, vy, omega) dead reckoned
+    from wheel encoders. All zero unless motor controls report wheel
+    distance. POST with 'reset' to start over from origin.
+    """
+    chassis.ensureready()
+    if 'reset' in request.form:
+      chassis.odometry.reset()
+    poll_when_idle()
+    return json.jsonify(chassis.odometry.state())
+
+  @app.route('/control_loop_stats', methods=['POST'])
+  def control_loop_stats():
+    """
+    Return a JSON representation of control loop timing statistics, for use
+    when tuning control loop frequency. Empty if control loop is not running.
+    """
+    chassis.ensureready()
+    if chassis.control_loop:
+      return json.jsonify(chassis.control_loop.stats())
+    else:
+      return json.jsonify({})
+
   @app.route('/steering_trim', methods=['GET','POST'])
   def steering_trim():
     """
@@ -215,12 +262,12 @@ class main_menu:
 
       if "move_to" in request.form:
         # Steer wheel to requested angle
-        adjWheel.steerto(int(request.form['move_to']))
+        chassis.run_on_bus(adjWheel.steeringcontrol, adjWheel.steerto, int(request.form['move_to']))
 
         return json.jsonify({'wheel':adjWheel.name, 'move_to':request.form['move_to']})
       elif "set_zero" in request.form:
         # Accept the current steering angle as new zero
-        adjWheel.steersetzero()
+        chassis.run_on_bus(adjWheel.steeringcontrol, adjWheel.steersetzero)
 
         return json.jsonify({'wheel':adjWheel.name, 'set_zero':request.form['set_zero']})
       else:
@@ -266,7 +313,7 @@ class main_menu:
     voltages = dict()
 
     for name,wheel in chassis.wheels.iteritems():
-      voltages[name] = wheel.motor_voltage()
+      voltages[name] = wheel.motor_voltage(chassis.run_on_bus)
 
     return render_template("input_voltage.html",
       voltages = voltages,
@@ -0,0 +1,139 @@
+"""
+MIT License
+
+Copyright (c) 2018 Roger Cheng
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import logging
+import threading
+import time
+
+class motion_mailbox(threading.Thread):
+  """
+  Sits between motion command sources (HTTP request handlers, RC receiver)
+  and the rover chassis. Callers post a command and return immediately,
+  this thread applies them to the chassis.
+
+  Only the newest pending command is kept: commands arriving faster than
+  the chassis update rate replace each other, and the final one wins.
+  Stops are never delayed: a stop or a zero velocity command is applied
+  as soon as this thread is free, ignoring the rate limit.
+  """
+  def __init__(self, chassis, rate):
+    threading.Thread.__init__(self, name="motion_mailbox")
+    self.setDaemon(True)
+    self.chassis = chassis
+
+    # Minimum time between applying two drive commands.
+    self.interval = 1.0/rate
+
+    # Guards everything below, and is notified whenever they change.
+    self.condition = threading.Condition()
+
+    # Newest (velocity, radius) not yet applied, or None.
+    self.pending = None
+
+    # True if pending command should skip the rate limit.
+    self.urgent = False
+
+    # True if wheels should be powered off before applying pending command.
+    self.stop_pending = False
+
+    # When the most recent command was applied.
+    self.lastapplied = 0
+
+  def post(self, velocity, radius):
+    """ Replace any pending command with the given velocity and radius. """
+    with self.condition:
+      self.pending = (velocity, radius)
+      self.urgent = (velocity == 0)
+      self.condition.notify()
+
+  def post_stop(self):
+    """ Discard pending command and power off the wheels. """
+    with self.condition:
+      self.pending = None
+      self.urgent = False
+      self.stop_pending = True
+      self.condition.notify()
+
+  def take(self):
+    """
+    Wait until there's something to do, then return a tuple (stop, command)
+    where stop is True if wheels should be powered off, and command is the
+    (velocity, radius) to apply afterwards or None.
+    """
+    with self.condition:
+      while True:
+        if self.has_urgent():
+          break
+
+        if self.pending:
+          remaining = self.lastapplied + self.interval - time.time()
+          if remaining <= 0:
+            break
+          self.condition.wait(remaining)
+        else:
+          self.condition.wait()
+
+      return self.collect()
+
+  def take_nowait(self):
+    """
+    Same as take() but returns immediately, ignoring the rate limit. Returns
+    (False, None) if there is nothing to do. Used by control_loop, which
+    has its own schedule.
+    """
+    with self.condition:
+      return self.collect()
+
+  def wait_urgent(self, timeout):
+    """
+    Wait up to timeout seconds. Returns True early if a stop or zero
+    velocity command arrives.
+    """
+    with self.condition:
+      if not self.has_urgent():
+        self.condition.wait(timeout)
+      return self.has_urgent()
+
+  def has_urgent(self):
+    """ True if a stop or zero velocity command is pending. Hold condition. """
+    return self.stop_pending or (self.pending is not None and self.urgent)
+
+  def collect(self):
+    """ Clear out and return (stop, command) pending. Hold condition. """
+    work = (self.stop_pending, self.pending)
+    self.stop_pending = False
+    self.pending = None
+    self.urgent = False
+    return work
+
+  def run(self):
+    while True:
+      stop, command = self.take()
+      try:
+        if stop:
+          self.chassis.stop_wheels()
+        if command:
+          self.chassis.move_velocity_radius(*command)
+      except Exception as e:
+        logging.getLogger(__name__).error("Motion command failed: %s", str(e))
+      self.lastapplied = time.time()
@@ -0,0 +1,124 @@
+"""
+MIT License
+
+Copyright (c) 2018 Roger Cheng
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import math
+
+# Python 2 does not have a constant for infinity. (Python 3 added math.inf.)
+infinity = float("inf")
+
+class motion_profile:
+  """
+  Generates intermediate (velocity, radius) setpoints between the current
+  rover motion and a commanded target, so rover speed and steering change
+  gradually instead of jumping. Called once per control loop tick, each
+  step only looks at the previous state so cost per tick is constant.
+
+  Velocity changes are limited by acceleration (percent per second) and
+  jerk (percent per second per second). Steering changes are made on
+  turning curvature (1/radius, zero is straight) and limited by turn_rate
+  in full steering locks per second. A limit of zero or None means that
+  part of the motion is not limited.
+  """
+  def __init__(self, chassis, acceleration, jerk, turn_rate):
+    self.chassis = chassis
+    self.acceleration = acceleration
+    self.jerk = jerk
+    self.turn_rate = turn_rate
+    self.reset()
+
+  def reset(self):
+    """ Rover is stopped, start from zero and drop the target. """
+    self.velocity = 0.0
+    self.accel = 0.0
+    self.curvature = 0.0
+    self.target_velocity = 0.0
+    self.target_radius = infinity
+    self.target_curvature = 0.0
+
+  def set_target(self, velocity, radius):
+    """ Set the (velocity, radius) to work towards. """
+    self.target_velocity = velocity
+    self.target_radius = radius
+    if abs(radius) == infinity:
+      self.target_curvature = 0.0
+    else:
+      self.target_curvature = 1.0/radius
+
+  def step(self, dt):
+    """
+    Advance the profile by dt seconds and return the (velocity, radius)
+    setpoint to command.
+    """
+    self.step_velocity(dt)
+    self.step_curvature(dt)
+
+    if self.curvature == self.target_curvature:
+      radius = self.target_radius
+    elif self.curvature == 0:
+      radius = infinity
+    else:
+      radius = 1.0/self.curvature
+
+    return (self.velocity, radius)
+
+  def step_velocity(self, dt):
+    error = self.target_velocity - self.velocity
+
+    if not self.acceleration:
+      self.velocity = self.target_velocity
+      self.accel = 0.0
+      return
+
+    # Acceleration to head towards target: as much as allowed, but no more
+    # than what can be ramped back down to zero (at jerk limit) by the time
+    # we arrive, to avoid overshoot.
+    desired = self.acceleration
+    if self.jerk:
+      desired = min(desired, math.sqrt(2 * self.jerk * abs(error)))
+    desired = math.copysign(desired, error)
+
+    if self.jerk:
+      change = self.jerk * dt
+      self.accel = self.accel + max(-change, min(change, desired - self.accel))
+    else:
+      self.accel = desired
+
+    velocity = self.velocity + self.accel * dt
+    if (self.target_velocity - velocity) * error <= 0:
+      # Reached or passed target.
+      velocity = self.target_velocity
+      self.accel = 0.0
+    self.velocity = velocity
+
+  def step_curvature(self, dt):
+    if not self.turn_rate:
+      self.curvature = self.target_curvature
+      return
+
+    # Full steering lock is the tightest turn chassis can make.
+    change = self.turn_rate * dt / self.chassis.minRadius
+    error = self.target_curvature - self.curvature
+    if abs(error) <= change:
+      self.curvature = self.target_curvature
+    else:
+      self.curvature = self.curvature + math.copysign(change, error)
@@ -0,0 +1,177 @@
+"""
+MIT License
+
+Copyright (c) 2018 Roger Cheng
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import math
+import threading
+
+class odometry:
+  """
+  Dead reckoning of rover position and heading from the distance each
+  wheel has rolled, as reported by motor controls with wheel encoders.
+
+  Uses the chassis coordinate system: +Y is front, +X is right, wheel
+  angle positive when steered toward +X. Heading is counterclockwise
+  looking down from above, zero being the direction rover faced at start
+  (or last reset). Distances are in whatever units the motor controls
+  report, normally the same units as wheel x/y in config_roverchassis.json.
+
+  Each update takes the distance every wheel rolled since the update
+  before, and finds the rigid body motion of the chassis (sideways,
+  forward, rotation) that best explains all of them in the least squares
+  sense. A wheel at (x,y) steered to angle a rolls
+    dx*sin(a) + dy*cos(a) + dphi*(x*cos(a) - y*sin(a))
+  for a chassis motion of (dx, dy, dphi).
+
+  Updates come from bus worker threads and state is read by HTTP request
+  threads, so all of them hold lock.
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.start()
+
+  def reset(self):
+    """ Start over at origin, facing +Y """
+    with self.lock:
+      self.start()
+
+  def start(self):
+    """ Set initial state, called with lock held """
+    # Position and heading (radians)
+    self.x = 0.0
+    self.y = 0.0
+    self.heading = 0.0
+
+    # Most recent chassis velocity: sideways and forward in distance per
+    # second, and rotation in radians per second.
+    self.vx = 0.0
+    self.vy = 0.0
+    self.omega = 0.0
+
+    # Distance reading of each wheel at the last update, and time of the
+    # newest sample used.
+    self.distances = dict()
+    self.time = None
+
+  def update(self, wheels, telemetry):
+    """
+    Advance position using latest wheel telemetry. Wheels is the chassis
+    dictionary of wheel name to roverwheel, telemetry the chassis table
+    of wheel name to 'rolling' and 'steering' samples. Rolling samples
+    must have 'distance' and 'time'. Steering angle is the measured one
+    where available, otherwise the commanded one.
+    """
+    with self.lock:
+      self.advance(wheels, telemetry)
+
+  def advance(self, wheels, telemetry):
+    """ Body of update(), called with lock held """
+    rows = list()
+    sampletime = None
+    for name, wheel in wheels.items():
+      samples = telemetry.get(name, dict())
+      rolling = samples.get('rolling', dict())
+      if 'distance' not in rolling:
+        continue
+
+      last = self.distances.get(name)
+      self.distances[name] = rolling['distance']
+      if sampletime is None or rolling['time'] > sampletime:
+        sampletime = rolling['time']
+      if last is None:
+        continue
+
+      angle = samples.get('steering', dict()).get('angle', wheel.angle)
+      rows.append((wheel.x, wheel.y, math.radians(angle), rolling['distance'] - last))
+
+    lasttime = self.time
+    self.time = sampletime
+    if not rows or sampletime == lasttime:
+      return
+
+    dx, dy, dphi = self.solve(rows)
+
+    # Apply chassis frame motion at heading midway through the move.
+    midheading = self.heading + dphi / 2
+    cos_h = math.cos(midheading)
+    sin_h = math.sin(midheading)
+    self.x = self.x + dx * cos_h - dy * sin_h
+    self.y = self.y + dx * sin_h + dy * cos_h
+    self.heading = math.atan2(math.sin(self.heading + dphi), math.cos(self.heading + dphi))
+
+    if lasttime is not None and sampletime > lasttime:
+      dt = sampletime - lasttime
+      self.vx = dx / dt
+      self.vy = dy / dt
+      self.omega = dphi / dt
+
+  @staticmethod
+  def solve(rows):
+    """
+    Least squares chassis motion (dx, dy, dphi) from list of wheel
+    (x, y, angle in radians, distance rolled) tuples. Motion that no wheel
+    can observe, such as sideways when all wheels point straight ahead,
+    comes out as zero.
+    """
+    # Normal equations: sum of a*a' and a*d over rows a with distance d.
+    m = [[0.0] * 3 for i in range(3)]
+    b = [0.0] * 3
+    for x, y, angle, distance in rows:
+      sin_a = math.sin(angle)
+      cos_a = math.cos(angle)
+      a = (sin_a, cos_a, x * cos_a - y * sin_a)
+      for i in range(3):
+        b[i] = b[i] + a[i] * distance
+        for j in range(3):
+          m[i][j] = m[i][j] + a[i] * a[j]
+
+    # A touch of damping keeps the unobservable parts at zero instead of
+    # making the system singular.
+    damping = 1e-9 * max(1.0, m[0][0] + m[1][1] + m[2][2])
+    for i in range(3):
+      m[i][i] = m[i][i] + damping
+
+    # Cramer's rule for the 3x3 system.
+    def det(c):
+      return (c[0][0] * (c[1][1] * c[2][2] - c[1][2] * c[2][1]) -
+              c[0][1] * (c[1][0] * c[2][2] - c[1][2] * c[2][0]) +
+              c[0][2] * (c[1][0] * c[2][1] - c[1][1] * c[2][0]))
+
+    d = det(m)
+    result = list()
+    for k in range(3):
+      c = [[b[i] if j == k else m[i][j] for j in range(3)] for i in range(3)]
+      result.append(det(c) / d)
+    return tuple(result)
+
+  def state(self):
+    """ Dictionary of position, heading and velocities, angles in degrees """
+    with self.lock:
+      return {
+        'x': self.x,
+        'y': self.y,
+        'heading': math.degrees(self.heading),
+        'vx': self.vx,
+        'vy': self.vy,
+        'omega': math.degrees(self.omega),
+        'time': self.time}
@@ -139,12 +139,12 @@ class RCReader(threading.Thread):
                             send_stop = 0
 
                             self.chassis.ensureready()
-                            self.chassis.move_velocity_radius(throttle, radius)
+                            self.chassis.post_motion(throttle, radius)
                         elif send_stop < 1:
                             send_stop = 1
 
                             self.chassis.ensureready()
-                            self.chassis.move_velocity_radius(throttle, radius)
+                            self.chassis.post_motion(throttle, radius)
 
             if (datetime.datetime.utcnow() - rc_use_input_time).total_seconds() > 2.0:
                 self.chassis.use_rc_input = False
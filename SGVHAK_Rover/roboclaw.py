@@ -9,15 +9,64 @@ import serial
 import struct
 import time
 
+def _crcentry(index):
+	crc = index << 8
+	for bit in range(0, 8):
+		if (crc&0x8000)  == 0x8000:
+			crc = ((crc << 1) ^ 0x1021)
+		else:
+			crc = crc << 1
+	return crc&0xFFFF
+
+#CRC16 (CCITT, polynomial 0x1021) of every possible byte value
+_crctable = [_crcentry(index) for index in range(0, 256)]
+
+def _crc16(data,length,crc=0):
+	for index in range(0, length):
+		crc = ((crc<<8)&0xFFFF) ^ _crctable[((crc>>8)^data[index])&0xFF]
+	return crc
+
+_command = struct.Struct('>BB')
+_crcword = struct.Struct('>H')
+
+#Frame value codes as used in _write helper names. Signed values are sent
+#as their two's complement, same as unsigned of the same size.
+_layoutcodes = {'1':('B',0xFF), '2':('H',0xFFFF), '4':('I',0xFFFFFFFF)}
+
+def _framelayout(layout):
+	"""
+	Returns (struct, value masks, buffer) for frames of given layout,
+	e.g. '4S441' for unsigned long, signed long, unsigned long, byte.
+	"""
+	fmt = '>BB'
+	masks = []
+	for code in layout.replace('S',''):
+		code,mask = _layoutcodes[code]
+		fmt = fmt + code
+		masks.append(mask)
+	packer = struct.Struct(fmt)
+	return (packer, masks, bytearray(packer.size+2))
+
 class Roboclaw:
 	'Roboclaw Interface Class'
 	
-	def __init__(self, comport, rate, timeout=0.01, retries=3):
+	def __init__(self, comport, rate, timeout=0.01, retries=3, readtimeout=1):
 		self.comport = comport
 		self.rate = rate
 		self.timeout = timeout;
+		self.readtimeout = readtimeout
 		self._trystimeout = retries
 		self._crc = 0;
+		self._frames = dict()
+		self._replies = dict()
+		self._pipeline = None
+		self._replay = None
+		#Optional per address round trip tracker and circuit breaker, with
+		#timeout(address), skip(address), is_open(address),
+		#success(address,rtt) and failure(address) methods. When set, each
+		#transaction waits only as long as its address normally needs and
+		#addresses that stopped answering are skipped.
+		self.devicehealth = None
 
 	#Command Enums
 	class Cmd():
@@ -118,20 +167,14 @@ class Roboclaw:
 		return
 		
 	def crc_update(self,data):
-		self._crc = self._crc ^ (data << 8)
-		for bit in range(0, 8):
-			if (self._crc&0x8000)  == 0x8000:
-				self._crc = ((self._crc << 1) ^ 0x1021)
-			else:
-				self._crc = self._crc << 1
+		self._crc = ((self._crc<<8)&0xFFFF) ^ _crctable[((self._crc>>8)^data)&0xFF]
 		return
 
 	def _sendcommand(self,address,command):
 		self.crc_clear()
 		self.crc_update(address)
-		self._port.write(chr(address))
 		self.crc_update(command)
-		self._port.write(chr(command))
+		self._port.write(_command.pack(address&0xFF,command&0xFF))
 		return
 
 	def _readchecksumword(self):
@@ -149,500 +192,322 @@ class Roboclaw:
 			return (1,val)	
 		return (0,0)
 		
-	def _readword(self):
-		val1 = self._readbyte()
-		if val1[0]:
-			val2 = self._readbyte()
-			if val2[0]:
-				return (1,val1[1]<<8|val2[1])
-		return (0,0)
-
-	def _readlong(self):
-		val1 = self._readbyte()
-		if val1[0]:
-			val2 = self._readbyte()
-			if val2[0]:
-				val3 = self._readbyte()
-				if val3[0]:
-					val4 = self._readbyte()
-					if val4[0]:
-						return (1,val1[1]<<24|val2[1]<<16|val3[1]<<8|val4[1])
-		return (0,0)	
-
-	def _readslong(self):
-		val = self._readlong()
-		if val[0]:
-			if val[1]&0x80000000:
-				return (val[0],val[1]-0x100000000)
-			return (val[0],val[1])
-		return (0,0)
-
-	def _writebyte(self,val):
-		self.crc_update(val&0xFF)
-		self._port.write(chr(val&0xFF))
-
-	def _writesbyte(self,val):
-		self._writebyte(val)
-
-	def _writeword(self,val):
-		self._writebyte((val>>8)&0xFF)
-		self._writebyte(val&0xFF)
-		
-	def _writesword(self,val):
-		self._writeword(val)
-
-	def _writelong(self,val):
-		self._writebyte((val>>24)&0xFF)
-		self._writebyte((val>>16)&0xFF)
-		self._writebyte((val>>8)&0xFF)
-		self._writebyte(val&0xFF)
-
-	def _writeslong(self,val):
-		self._writelong(val)
-
-	def _read1(self,address,cmd):
+	def _receive(self,frame,reply):
+		#Read ack (reply None) or reply of given struct layout for a frame
+		#already sent. Returns True for ack, tuple of values for reply, None
+		#if nothing valid was received.
+		if reply is None:
+			ack = self._port.read(1)
+			if len(ack) and bytearray(ack)[0]==0xFF:
+				return True
+			return None
+		data = self._port.read(reply.size)
+		if len(data)==reply.size:
+			buf = bytearray(data)
+			vals = reply.unpack_from(buf)
+			crc = _crc16(bytearray(frame),len(frame))
+			if _crc16(buf,reply.size-2,crc)==vals[-1]:
+				return vals[:-1]
+		return None
+
+	def _settimeout(self,address):
+		#Set read timeout to what the health tracker expects of address.
+		timeout = round(self.devicehealth.timeout(address),3)
+		if self._port.timeout != timeout:
+			self._port.timeout = timeout
+
+	def _transact(self,frame,reply):
+		#Send a complete frame and wait for its ack or reply, retrying on
+		#timeout or bad crc.
 		trys = self._trystimeout
-		while 1:
+		health = self.devicehealth
+		if health is not None:
+			address = bytearray(frame[:1])[0]
+			if health.skip(address):
+				return None
+			if health.is_open(address):
+				trys = 1
+		while trys:
+			if health is not None:
+				self._settimeout(address)
+				start = time.time()
 			self._port.flushInput()
-			self._sendcommand(address,cmd)
-			val1 = self._readbyte()
-			if val1[0]:
-				crc = self._readchecksumword()
-				if crc[0]:
-					if self._crc&0xFFFF!=crc[1]&0xFFFF:
-						return (0,0)
-					return (1,val1[1])
+			self._port.write(frame)
+			result = self._receive(frame,reply)
+			if result is not None:
+				if health is not None:
+					health.success(address,time.time()-start)
+				return result
+			if health is not None:
+				health.failure(address)
 			trys-=1
-			if trys==0:
-				break
+		return None
+
+	def _readframe(self,address,cmd,reply):
+		#Send command and read reply of known size plus its crc with one
+		#read call, then decode and check crc over the whole reply at once.
+		packer = self._replies.get(reply)
+		if packer is None:
+			packer = struct.Struct('>'+reply+'H')
+			self._replies[reply] = packer
+		frame = _command.pack(address&0xFF,cmd&0xFF)
+		if self._pipeline is not None:
+			self._pipeline.append((frame,packer))
+			return None
+		if self._replay is not None:
+			return self._replay.pop()
+		return self._transact(frame,packer)
+
+	def _read1(self,address,cmd):
+		val = self._readframe(address,cmd,'B')
+		if val:
+			return (1,val[0])
 		return (0,0)
 
 	def _read2(self,address,cmd):
-		trys = self._trystimeout
-		while 1:
-			self._port.flushInput()
-			self._sendcommand(address,cmd)
-			val1 = self._readword()
-			if val1[0]:
-				crc = self._readchecksumword()
-				if crc[0]:
-					if self._crc&0xFFFF!=crc[1]&0xFFFF:
-						return (0,0)
-					return (1,val1[1])
-			trys-=1
-			if trys==0:
-				break
+		val = self._readframe(address,cmd,'H')
+		if val:
+			return (1,val[0])
 		return (0,0)
 
 	def _read4(self,address,cmd):
-		trys = self._trystimeout
-		while 1:
-			self._port.flushInput()
-			self._sendcommand(address,cmd)
-			val1 = self._readlong()
-			if val1[0]:
-				crc = self._readchecksumword()
-				if crc[0]:
-					if self._crc&0xFFFF!=crc[1]&0xFFFF:
-						return (0,0)
-					return (1,val1[1])
-			trys-=1
-			if trys==0:
-				break
+		val = self._readframe(address,cmd,'I')
+		if val:
+			return (1,val[0])
 		return (0,0)
 
 	def _read4_1(self,address,cmd):
-		trys = self._trystimeout
-		while 1:
-			self._port.flushInput()
-			self._sendcommand(address,cmd)
-			val1 = self._readslong()
-			if val1[0]:
-				val2 = self._readbyte()
-				if val2[0]:
-					crc = self._readchecksumword()
-					if crc[0]:
-						if self._crc&0xFFFF!=crc[1]&0xFFFF:
-							return (0,0)
-						return (1,val1[1],val2[1])
-			trys-=1
-			if trys==0:
-				break
+		val = self._readframe(address,cmd,'iB')
+		if val:
+			return (1,val[0],val[1])
 		return (0,0)
 
 	def _read_n(self,address,cmd,args):
-		trys = self._trystimeout
-		while 1:
-			self._port.flushInput()
-			trys-=1
-			if trys==0:
-				break
-			failed=False
-			self._sendcommand(address,cmd)
-			data = [1,]
-			for i in range(0,args):
-				val = self._readlong()
-				if val[0]==0:
-					failed=True
-					break
-				data.append(val[1])
-			if failed:
-				continue
-			crc = self._readchecksumword()
-			if crc[0]:
-				if self._crc&0xFFFF==crc[1]&0xFFFF:
-					return (data);
+		val = self._readframe(address,cmd,'I'*args)
+		if val:
+			return [1,]+list(val)
 		return (0,0,0,0,0)
 
 	def _writechecksum(self):
-		self._writeword(self._crc&0xFFFF)
+		self._port.write(_crcword.pack(self._crc&0xFFFF))
 		val = self._readbyte()
 		if(len(val)>0):
 			if val[0]:
 				return True
 		return False
 
+	def _writeframe(self,address,cmd,layout,vals):
+		#Build whole frame (address, command, values, crc) in one buffer
+		#and send with a single write.
+		frame = self._frames.get(layout)
+		if frame is None:
+			frame = _framelayout(layout)
+			self._frames[layout] = frame
+		packer,masks,buf = frame
+		args = [address&0xFF,cmd&0xFF]
+		for val,mask in zip(vals,masks):
+			args.append(val&mask)
+		packer.pack_into(buf,0,*args)
+		crc = _crc16(buf,len(buf)-2)
+		_crcword.pack_into(buf,len(buf)-2,crc)
+		if self._pipeline is not None:
+			self._pipeline.append((bytes(buf),None))
+			return True
+		if self._replay is not None:
+			return self._replay.pop() is not None
+		return self._transact(buf,None) is not None
+
 	def _write0(self,address,cmd):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'',())
 
 	def _write1(self,address,cmd,val):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writebyte(val)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'1',(val,))
 
 	def _write11(self,address,cmd,val1,val2):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writebyte(val1)
-			self._writebyte(val2)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'11',(val1,val2))
 
 	def _write111(self,address,cmd,val1,val2,val3):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writebyte(val1)
-			self._writebyte(val2)
-			self._writebyte(val3)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'111',(val1,val2,val3))
 
 	def _write2(self,address,cmd,val):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writeword(val)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'2',(val,))
 
 	def _writeS2(self,address,cmd,val):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writesword(val)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'S2',(val,))
 
 	def _write22(self,address,cmd,val1,val2):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writeword(val1)
-			self._writeword(val2)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'22',(val1,val2))
 
 	def _writeS22(self,address,cmd,val1,val2):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writesword(val1)
-			self._writeword(val2)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'S22',(val1,val2))
 
 	def _writeS2S2(self,address,cmd,val1,val2):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writesword(val1)
-			self._writesword(val2)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'S2S2',(val1,val2))
 
 	def _writeS24(self,address,cmd,val1,val2):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writesword(val1)
-			self._writelong(val2)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'S24',(val1,val2))
 
 	def _writeS24S24(self,address,cmd,val1,val2,val3,val4):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writesword(val1)
-			self._writelong(val2)
-			self._writesword(val3)
-			self._writelong(val4)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'S24S24',(val1,val2,val3,val4))
 
 	def _write4(self,address,cmd,val):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writelong(val)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'4',(val,))
 
 	def _writeS4(self,address,cmd,val):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writeslong(val)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'S4',(val,))
 
 	def _write44(self,address,cmd,val1,val2):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writelong(val1)
-			self._writelong(val2)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'44',(val1,val2))
 
 	def _write4S4(self,address,cmd,val1,val2):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writelong(val1)
-			self._writeslong(val2)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'4S4',(val1,val2))
 
 	def _writeS4S4(self,address,cmd,val1,val2):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writeslong(val1)
-			self._writeslong(val2)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'S4S4',(val1,val2))
 
 	def _write441(self,address,cmd,val1,val2,val3):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writelong(val1)
-			self._writelong(val2)
-			self._writebyte(val3)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'441',(val1,val2,val3))
 
 	def _writeS441(self,address,cmd,val1,val2,val3):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writeslong(val1)
-			self._writelong(val2)
-			self._writebyte(val3)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'S441',(val1,val2,val3))
 
 	def _write4S4S4(self,address,cmd,val1,val2,val3):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writelong(val1)
-			self._writeslong(val2)
-			self._writeslong(val3)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'4S4S4',(val1,val2,val3))
 
 	def _write4S441(self,address,cmd,val1,val2,val3,val4):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writelong(val1)
-			self._writeslong(val2)
-			self._writelong(val3)
-			self._writebyte(val4)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'4S441',(val1,val2,val3,val4))
 
 	def _write4444(self,address,cmd,val1,val2,val3,val4):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writelong(val1)
-			self._writelong(val2)
-			self._writelong(val3)
-			self._writelong(val4)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'4444',(val1,val2,val3,val4))
 
 	def _write4S44S4(self,address,cmd,val1,val2,val3,val4):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writelong(val1)
-			self._writeslong(val2)
-			self._writelong(val3)
-			self._writeslong(val4)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'4S44S4',(val1,val2,val3,val4))
 
 	def _write44441(self,address,cmd,val1,val2,val3,val4,val5):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writelong(val1)
-			self._writelong(val2)
-			self._writelong(val3)
-			self._writelong(val4)
-			self._writebyte(val5)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'44441',(val1,val2,val3,val4,val5))
 
 	def _writeS44S441(self,address,cmd,val1,val2,val3,val4,val5):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writeslong(val1)
-			self._writelong(val2)
-			self._writeslong(val3)
-			self._writelong(val4)
-			self._writebyte(val5)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'S44S441',(val1,val2,val3,val4,val5))
 
 	def _write4S44S441(self,address,cmd,val1,val2,val3,val4,val5,val6):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writelong(val1)
-			self._writeslong(val2)
-			self._writelong(val3)
-			self._writeslong(val4)
-			self._writelong(val5)
-			self._writebyte(val6)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'4S44S441',(val1,val2,val3,val4,val5,val6))
 
 	def _write4S444S441(self,address,cmd,val1,val2,val3,val4,val5,val6,val7):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(self,address,cmd)
-			self._writelong(val1)
-			self._writeslong(val2)
-			self._writelong(val3)
-			self._writelong(val4)
-			self._writeslong(val5)
-			self._writelong(val6)
-			self._writebyte(val7)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'4S444S441',(val1,val2,val3,val4,val5,val6,val7))
 
 	def _write4444444(self,address,cmd,val1,val2,val3,val4,val5,val6,val7):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writelong(val1)
-			self._writelong(val2)
-			self._writelong(val3)
-			self._writelong(val4)
-			self._writelong(val5)
-			self._writelong(val6)
-			self._writelong(val7)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'4444444',(val1,val2,val3,val4,val5,val6,val7))
 
 	def _write444444441(self,address,cmd,val1,val2,val3,val4,val5,val6,val7,val8,val9):
-		trys=self._trystimeout
-		while trys:
-			self._sendcommand(address,cmd)
-			self._writelong(val1)
-			self._writelong(val2)
-			self._writelong(val3)
-			self._writelong(val4)
-			self._writelong(val5)
-			self._writelong(val6)
-			self._writelong(val7)
-			self._writelong(val8)
-			self._writebyte(val9)
-			if self._writechecksum():
-				return True
-			trys=trys-1
-		return False
+		return self._writeframe(address,cmd,'444444441',(val1,val2,val3,val4,val5,val6,val7,val8,val9))
 
 	#User accessible functions
+	def BeginPipeline(self):
+		"""
+		Start queueing transactions instead of sending them. Until
+		EndPipeline, write commands return True once queued and read
+		commands return a failure tuple; actual results come from
+		EndPipeline.
+
+		Only queue commands that are safe to send twice: reads, and
+		writes that set a value or an immediate (buffer=1) motion. See
+		EndPipeline for why.
+		"""
+		self._pipeline = []
+
+	def EndPipeline(self):
+		"""
+		Send all queued transactions back to back in one write, then match
+		acks and replies to them in queued order. Returns a list with one
+		entry per transaction in that order: True for an acknowledged write,
+		tuple of raw reply values for a read, None for failure.
+
+		If a transaction fails, the stream can no longer be trusted to line
+		up. Acks all look alike, so a missing ack may show up as a failure
+		further down, and a lost ack can't be told from a lost write.
+		Everything after the last read reply that passed its crc check is
+		retried one at a time, which sends again writes the RoboClaw may
+		already have carried out. Commands that add to a RoboClaw buffer
+		(buffer=0) must not be pipelined, send them with Once instead.
+		"""
+		queue = self._pipeline
+		self._pipeline = None
+		results = []
+		if not queue:
+			return results
+		#Transactions with addresses that stopped answering fail right
+		#away without being sent.
+		skipped = []
+		if self.devicehealth is not None:
+			skipped = [self.devicehealth.skip(bytearray(frame[:1])[0]) for frame,reply in queue]
+			sent = [queue[i] for i in range(len(queue)) if not skipped[i]]
+		else:
+			sent = queue
+		start = time.time()
+		if sent:
+			self._port.flushInput()
+			self._port.write(b''.join([frame for frame,reply in sent]))
+		verified = 0
+		for frame,reply in sent:
+			if self.devicehealth is not None:
+				self._settimeout(bytearray(frame[:1])[0])
+			result = self._receive(frame,reply)
+			if result is None:
+				del results[verified:]
+				break
+			results.append(result)
+			if reply is not None:
+				verified = len(results)
+		if self.devicehealth is not None and results:
+			#Replies came back one after another, so each device's share
+			#of the time is the nearest thing to its own round trip.
+			rtt = (time.time()-start)/len(results)
+			for frame,reply in sent[:len(results)]:
+				self.devicehealth.success(bytearray(frame[:1])[0],rtt)
+		for frame,reply in sent[len(results):]:
+			results.append(self._transact(frame,reply))
+		if skipped:
+			results.reverse()
+			results = [None if skip else results.pop() for skip in skipped]
+		return results
+
+	def Pipelined(self,calls):
+		"""
+		Run a list of (function, args) calls of this API as one pipeline.
+		Returns a list of results in the form each function normally
+		returns. Each function must make exactly one transaction, which is
+		true of everything except ReadVersion, and must be safe to send
+		twice as described in BeginPipeline.
+		"""
+		self.BeginPipeline()
+		try:
+			for function,args in calls:
+				function(*args)
+		except:
+			self._pipeline = None
+			raise
+		#Call each function again, this time handing it its pipelined
+		#result in place of a transaction, to get results in normal form.
+		self._replay = self.EndPipeline()
+		self._replay.reverse()
+		try:
+			return [function(*args) for function,args in calls]
+		finally:
+			self._replay = None
+
+	def Once(self,function,args):
+		"""
+		Run one call of this API with a single attempt instead of retrying.
+		For commands that must not run twice, such as buffered segments: if
+		the ack is lost a retry would queue the same segment again.
+		"""
+		trys = self._trystimeout
+		self._trystimeout = 1
+		try:
+			return function(*args)
+		finally:
+			self._trystimeout = trys
+
 	def SendRandomData(self,cnt):
 		for i in range(0,cnt):
 			byte = random.getrandbits(8)
@@ -711,24 +576,13 @@ class Roboclaw:
 		while 1:
 			self._port.flushInput()
 			self._sendcommand(address,self.Cmd.GETVERSION)
-			str = ""
-			passed = True
-			for i in range(0,48):
-				data = self._port.read(1)
-				if len(data):
-					val = ord(data)
-					self.crc_update(val)
-					if(val==0):
-						break
-					str+=data[0]
-				else:
-					passed = False
-					break
-			if passed:
+			data = self._port.read_until(b'\0',48)
+			if len(data) and data[-1:]==b'\0':
+				buf = bytearray(data)
 				crc = self._readchecksumword()
 				if crc[0]:
-					if self._crc&0xFFFF==crc[1]&0xFFFF:
-						return (1,str)
+					if _crc16(buf,len(buf),self._crc)==crc[1]:
+						return (1,str(buf[:-1].decode('ascii','replace')))
 					else:
 						time.sleep(0.01)
 			trys-=1
@@ -842,7 +696,7 @@ class Roboclaw:
 		return (0,0,0)
 
 	def SpeedAccelM1M2_2(self,address,accel1,speed1,accel2,speed2):
-		return self._write4S44S4(address,self.Cmd.MIXEDSPEED2ACCEL,accel,speed1,accel2,speed2)
+		return self._write4S44S4(address,self.Cmd.MIXEDSPEED2ACCEL,accel1,speed1,accel2,speed2)
 
 	def SpeedAccelDistanceM1M2_2(self,address,accel1,speed1,distance1,accel2,speed2,distance2,buffer):
 		return self._write4S444S441(address,self.Cmd.MIXEDSPEED2ACCELDIST,accel1,speed1,distance1,accel2,speed2,distance2,buffer)
@@ -939,23 +793,9 @@ class Roboclaw:
 		return self._write111(address,self.Cmd.SETPINFUNCTIONS,S3mode,S4mode,S5mode)
 
 	def ReadPinFunctions(self,address):
-		trys = self._trystimeout
-		while 1:
-			self._sendcommand(address,self.Cmd.GETPINFUNCTIONS)
-			val1 = self._readbyte()
-			if val1[0]:
-				val2 = self._readbyte()
-				if val1[0]:
-					val3 = self._readbyte()
-					if val1[0]:
-						crc = self._readchecksumword()
-						if crc[0]:
-							if self._crc&0xFFFF!=crc[1]&0xFFFF:
-								return (0,0)
-							return (1,val1[1],val2[1],val3[1])
-			trys-=1
-			if trys==0:
-				break
+		val = self._readframe(address,self.Cmd.GETPINFUNCTIONS,'BBB')
+		if val:
+			return (1,val[0],val[1],val[2])
 		return (0,0)
 
 	def SetDeadBand(self,address,min,max):
@@ -1035,8 +875,33 @@ class Roboclaw:
 
 	def Open(self):
 		try:
-			self._port = serial.Serial(port=self.comport, baudrate=self.rate, timeout=1, interCharTimeout=self.timeout)
+			self._port = serial.Serial(port=self.comport, baudrate=self.rate, timeout=self.readtimeout, interCharTimeout=self.timeout)
 		except:
 			return 0
 		return 1
 
+
+if __name__ == '__main__':
+	#Microbenchmark of command write path against a fake serial port that
+	#counts write calls and always acknowledges.
+	class _CountingPort:
+		def __init__(self):
+			self.writes = 0
+			self.written = 0
+		def write(self,data):
+			self.writes += 1
+			self.written += len(data)
+		def read(self,size=1):
+			return '\xff'*size
+		def flushInput(self):
+			pass
+
+	rc = Roboclaw('benchmark',115200)
+	rc._port = _CountingPort()
+	count = 10000
+	start = time.time()
+	for i in range(0,count):
+		rc.SpeedAccelDeccelPositionM1(128,1000,-i,1000,i,1)
+	elapsed = time.time()-start
+	print('SpeedAccelDeccelPositionM1: %.1f us/command, %.1f writes/command, %.1f bytes/command' %
+		(elapsed*1e6/count, float(rc._port.writes)/count, float(rc._port.written)/count))
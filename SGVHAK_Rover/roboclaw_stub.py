@@ -65,18 +65,48 @@ class Roboclaw_stub:
   def SpeedAccelM2(self,address,accel,speed):
     return True
 
+  def SpeedAccelM1M2(self,address,accel,speed1,speed2):
+    return True
+
+  def SpeedAccelM1M2_2(self,address,accel1,speed1,accel2,speed2):
+    return True
+
+  def SpeedAccelDistanceM1(self,address,accel,speed,distance,buffer):
+    return True
+
+  def SpeedAccelDistanceM2(self,address,accel,speed,distance,buffer):
+    return True
+
+  def ReadBuffers(self,address):
+    return (1,0x80,0x80)
+
+  def ReadM1VelocityPID(self,address):
+    return (1,0,0,0,0)
+
+  def ReadM2VelocityPID(self,address):
+    return (1,0,0,0,0)
+
   def SetM1PositionPID(self,address,kp,ki,kd,kimax,deadzone,min,max):
     return True
 
   def SetM2PositionPID(self,address,kp,ki,kd,kimax,deadzone,min,max):
     return True
 
+  def ReadM1PositionPID(self,address):
+    return (1,0,0,0,0,0,0,0)
+
+  def ReadM2PositionPID(self,address):
+    return (1,0,0,0,0,0,0,0)
+
   def SpeedAccelDeccelPositionM1(self,address,accel,speed,deccel,position,buffer):
     return True
 
   def SpeedAccelDeccelPositionM2(self,address,accel,speed,deccel,position,buffer):
     return True
 
+  def SpeedAccelDeccelPositionM1M2(self,address,accel1,speed1,deccel1,position1,accel2,speed2,deccel2,position2,buffer):
+    return True
+
   def ReadVersion(self,address):
     return (1, self.name)
 
@@ -86,5 +116,20 @@ class Roboclaw_stub:
   def SetM2MaxCurrent(self,address,max):
     return True
 
+  def ReadM1MaxCurrent(self,address):
+    return (1,0)
+
+  def ReadM2MaxCurrent(self,address):
+    return (1,0)
+
+  def WriteNVM(self,address):
+    return True
+
+  def Pipelined(self,calls):
+    return [function(*args) for function,args in calls]
+
+  def Once(self,function,args):
+    return function(*args)
+
   def Open(self):
     return 1
@@ -21,12 +21,19 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
+import collections
+import logging
 import configuration
+import device_health
 from roboclaw import Roboclaw
 from roboclaw_stub import Roboclaw_stub
 
 # For the 'buffered' parameter into RoboClaw API.
 immediate_execution = 1
+buffered_execution = 0
+
+# RoboClaw ReadBuffers value when buffer is empty and last command is done.
+buffer_idle = 0x80
 
 def apiget(result_tuple, errormessage="RoboClaw API Getter"):
   """
@@ -55,6 +62,20 @@ def apiset(result, errormessage="RoboClaw API Setter"):
   if not result:
     raise ValueError(errormessage)
 
+def velocity_pid_words(p, i, d, qpps):
+  """
+  Velocity PID parameters as the integers RoboClaw stores, so values from
+  configuration can be compared with values read back.
+  """
+  return (int(p*65536), int(i*65536), int(d*65536), qpps & 0xFFFFFFFF)
+
+def position_pid_words(p, i, d, maxi, deadzone, minimum, maximum):
+  """
+  Position PID parameters as the integers RoboClaw stores.
+  """
+  return (int(p*1024), int(i*1024), int(d*1024), maxi & 0xFFFFFFFF,
+    deadzone & 0xFFFFFFFF, minimum & 0xFFFFFFFF, maximum & 0xFFFFFFFF)
+
 class roboclaw_wrapper:
   """
   Class that wraps the roboclaw Python API released by Ion Motion Control.
@@ -73,9 +94,27 @@ class roboclaw_wrapper:
               executed at a time.
   """
 
+  # Deadbands and refresh interval used by roverchassis.roverwheel to skip
+  # sending commands that would not change anything.
+  # Velocity and position commands are fine grained encoder counts, and
+  # every command is acknowledged so there is no need to refresh.
+  angle_deadband = 0.1
+  velocity_deadband = 0.1
+  refresh_interval = None
+
   def __init__(self):
     self.roboclaw = None
 
+    # Motion segments waiting to go into a RoboClaw command buffer, as
+    # deque of (API function, arguments, error message) per (address, motor)
+    self.segments = dict()
+
+    # Settings read back from each RoboClaw address: dictionary of
+    # (setting, motor) to tuple of values as RoboClaw stores them. And
+    # addresses whose settings were changed but not yet written to NVM.
+    self.settings = dict()
+    self.unsaved = set()
+
   @staticmethod
   def check_id(id):
     """
@@ -135,6 +174,12 @@ class roboclaw_wrapper:
     self.velocityparams = allparams['velocity']
     self.angleparams = allparams['angle']
 
+    # How many buffered segments to keep queued on RoboClaw at any time.
+    self.bufferdepth = allparams.get('buffer', dict()).get('depth', 4)
+
+    # Whether to write changed settings into RoboClaw non-volatile memory.
+    self.persist = allparams.get('settings', dict()).get('persist', False)
+
     # Use connect configuration to create a RoboClaw API handle
     portname = allparams['connect']['port']
     if portname == 'TEST':
@@ -143,9 +188,13 @@ class roboclaw_wrapper:
       baudrate = allparams['connect']['baudrate']
       timeout = allparams['connect']['timeout']
       retries = allparams['connect']['retries']
-      newrc = Roboclaw(portname, baudrate, timeout, retries)
+      readtimeout = allparams['connect'].get('read_timeout', 1.0)
+      newrc = Roboclaw(portname, baudrate, timeout, retries, readtimeout)
 
       if newrc.Open():
+        # Wait on each RoboClaw address only as long as it usually takes to
+        # answer, readtimeout being the most, and skip any that stopped.
+        newrc.devicehealth = device_health.device_health("RoboClaw", readtimeout)
         self.roboclaw = newrc
       else:
         raise ValueError("Could not connect to RoboClaw. {} @ {}".format(portname, baudrate))
@@ -171,6 +220,8 @@ class roboclaw_wrapper:
 
     level = int(64 + (pct * 63)/100) # 0 is full reverse, 64 is stop, 127 is full forward.
 
+    self.segments.pop((address, motor), None)
+
     error = "RoboClaw M{}@{} power at {} representing {} percent".format(motor, address, level, pct)
 
     if motor==1:
@@ -178,6 +229,57 @@ class roboclaw_wrapper:
     else:
       apiset(self.roboclaw.ForwardBackwardM2(address,level), error)
 
+  def read_settings(self, address):
+    """
+    Returns settings of both motors of the RoboClaw at given address, read
+    back in one pipeline the first time and cached after that. Settings
+    that could not be read are absent.
+    """
+    if address in self.settings:
+      return self.settings[address]
+
+    rc = self.roboclaw
+    reads = [
+      (('current', 1), rc.ReadM1MaxCurrent, lambda values: values),
+      (('current', 2), rc.ReadM2MaxCurrent, lambda values: values),
+      (('velocity', 1), rc.ReadM1VelocityPID, lambda values: velocity_pid_words(*values)),
+      (('velocity', 2), rc.ReadM2VelocityPID, lambda values: velocity_pid_words(*values)),
+      (('position', 1), rc.ReadM1PositionPID, lambda values: position_pid_words(*values)),
+      (('position', 2), rc.ReadM2PositionPID, lambda values: position_pid_words(*values))]
+
+    results = rc.Pipelined([(function, (address,)) for key, function, words in reads])
+
+    settings = dict()
+    for (key, function, words), result in zip(reads, results):
+      if result[0]:
+        settings[key] = words(tuple(result[1:]))
+    self.settings[address] = settings
+
+    return settings
+
+  def update_setting(self, address, key, values, function, args, error):
+    """
+    Send a setting to RoboClaw, unless it already has these values.
+    """
+    if self.read_settings(address).get(key) == values:
+      return
+
+    apiset(function(*args), error)
+    self.settings[address][key] = values
+    self.unsaved.add(address)
+
+  def save_settings(self, id):
+    """
+    Write settings into RoboClaw non-volatile memory if they were changed
+    and configuration asks for it.
+    """
+    address, motor, inverted = self.check_id(id)
+    if not self.persist or address not in self.unsaved:
+      return
+
+    apiset(self.roboclaw.WriteNVM(address), "RoboClaw WriteNVM @{}".format(address))
+    self.unsaved.discard(address)
+
   def set_max_current(self, id, current):
     """
     Restrict the specified motor's maximum allowed amperage draw.
@@ -188,9 +290,12 @@ class roboclaw_wrapper:
     error = "Restricting RoboClaw M{}@{} to {} * 10 mA".format(motor,address,current)
 
     if motor==1:
-      apiset(self.roboclaw.SetM1MaxCurrent(address, current))
+      function = self.roboclaw.SetM1MaxCurrent
     else:
-      apiset(self.roboclaw.SetM2MaxCurrent(address, current))
+      function = self.roboclaw.SetM2MaxCurrent
+
+    self.update_setting(address, ('current', motor), (current,),
+      function, (address, current), error)
 
   def set_velocity_pid(self, id, params):
     """
@@ -207,9 +312,12 @@ class roboclaw_wrapper:
     error = "RoboClaw M{}@{} Velocity P{} I{} D{} QPPS{}".format(motor, address, p, i, d, qpps)
 
     if motor==1:
-      apiset(self.roboclaw.SetM1VelocityPID(*args), error)
+      function = self.roboclaw.SetM1VelocityPID
     else:
-      apiset(self.roboclaw.SetM2VelocityPID(*args), error)
+      function = self.roboclaw.SetM2VelocityPID
+
+    self.update_setting(address, ('velocity', motor), velocity_pid_words(*args[1:]),
+      function, args, error)
 
   def init_velocity(self, id):
     """
@@ -217,12 +325,22 @@ class roboclaw_wrapper:
     """
     self.set_max_current(id, self.velocityparams['maxCurrent'])
     self.set_velocity_pid(id, self.velocityparams['velocity'])
+    self.save_settings(id)
 
   def velocity(self, id, pct_velocity):
     """
     Run the specified motor (address,motor#) at the specified percentage of
     maximum velocity.
     """
+    address, motor, params = self.velocity_params(id, pct_velocity)
+    self.segments.pop((address, motor), None)
+    function, args, error = self.velocity_single_command(address, motor, params)
+    apiset(function(*args), error)
+
+  def velocity_params(self, id, pct_velocity):
+    """
+    Returns (address, motor, (acceleration, qpps)) for velocity().
+    """
     address, motor, inverted = self.check_id(id)
     self.check_roboclaw()
 
@@ -235,13 +353,28 @@ class roboclaw_wrapper:
       qpps = -qpps
 
     acceleration = self.velocityparams['acceleration']
+
+    return (address, motor, (acceleration, qpps))
+
+  def velocity_command(self, id, pct_velocity):
+    """
+    Returns (API function, arguments, error message) for velocity().
+    """
+    return self.velocity_single_command(*self.velocity_params(id, pct_velocity))
+
+  def velocity_single_command(self, address, motor, params):
+    """
+    Returns (API function, arguments, error message) running one motor at
+    velocity given by parameter tuple from velocity_params().
+    """
+    acceleration, qpps = params
     args = (address, acceleration, qpps)
     error = "Velocity {} acceleration {} on RoboClaw M{}@{}".format(qpps, acceleration, motor, address)
 
     if motor==1:
-      apiset(self.roboclaw.SpeedAccelM1(*args), error)
+      return (self.roboclaw.SpeedAccelM1, args, error)
     else:
-      apiset(self.roboclaw.SpeedAccelM2(*args), error)
+      return (self.roboclaw.SpeedAccelM2, args, error)
 
   def set_position_pid(self, id, params, limit):
     """
@@ -260,9 +393,12 @@ class roboclaw_wrapper:
       motor, address, p, i, d, maxi, deadzone, -limit, limit)
 
     if motor==1:
-      apiset(self.roboclaw.SetM1PositionPID(*args), error)
+      function = self.roboclaw.SetM1PositionPID
     else:
-      apiset(self.roboclaw.SetM2PositionPID(*args), error)
+      function = self.roboclaw.SetM2PositionPID
+
+    self.update_setting(address, ('position', motor), position_pid_words(*args[1:]),
+      function, args, error)
 
   def init_angle(self, id):
     """
@@ -272,6 +408,7 @@ class roboclaw_wrapper:
     self.set_max_current(id, p['maxCurrent'])
     self.set_velocity_pid(id, p['velocity'])
     self.set_position_pid(id, p['position'], p['hardstop']['count'])
+    self.save_settings(id)
 
   def maxangle(self, id):
     """
@@ -285,6 +422,16 @@ class roboclaw_wrapper:
     Immediately moves the specified motor (address,motor#) to the specified
     angle expressed in number of degrees off zero center, positive clockwise.
     """
+    address, motor, params = self.angle_params(id, angle)
+    self.segments.pop((address, motor), None)
+    function, args, error = self.angle_single_command(address, motor, params)
+    apiset(function(*args), error)
+
+  def angle_params(self, id, angle):
+    """
+    Returns (address, motor, (acceleration, speed, deceleration, position))
+    for angle().
+    """
     address, motor, inverted = self.check_id(id)
     self.check_roboclaw()
 
@@ -303,13 +450,187 @@ class roboclaw_wrapper:
     acceleration = self.angleparams['accel']
     speed = self.angleparams['speed']
     deceleration = self.angleparams['decel']
+
+    return (address, motor, (acceleration, speed, deceleration, position))
+
+  def angle_command(self, id, angle):
+    """
+    Returns (API function, arguments, error message) for angle().
+    """
+    return self.angle_single_command(*self.angle_params(id, angle))
+
+  def angle_single_command(self, address, motor, params):
+    """
+    Returns (API function, arguments, error message) moving one motor to
+    position given by parameter tuple from angle_params().
+    """
+    acceleration, speed, deceleration, position = params
     args = (address, acceleration, speed, deceleration, position, immediate_execution)
     error = "Position {} via {}/{}/{} on RoboClaw M{}@{}".format(position, acceleration, speed, deceleration, motor, address)
 
     if motor==1:
-      apiset(self.roboclaw.SpeedAccelDeccelPositionM1(*args), error)
+      return (self.roboclaw.SpeedAccelDeccelPositionM1, args, error)
+    else:
+      return (self.roboclaw.SpeedAccelDeccelPositionM2, args, error)
+
+  def angle_pair_command(self, address, m1, m2):
+    """
+    Returns (API function, arguments, error message) moving both motors of
+    a RoboClaw to positions in one packet. m1 and m2 are the parameter
+    tuples from angle_params().
+    """
+    args = (address,) + m1 + m2 + (immediate_execution,)
+    error = "Positions {} and {} on RoboClaw M1/M2@{}".format(m1[3], m2[3], address)
+
+    return (self.roboclaw.SpeedAccelDeccelPositionM1M2, args, error)
+
+  def velocity_pair_command(self, address, m1, m2):
+    """
+    Returns (API function, arguments, error message) running both motors of
+    a RoboClaw at velocities in one packet. m1 and m2 are the parameter
+    tuples from velocity_params().
+    """
+    error = "Velocities {} and {} on RoboClaw M1/M2@{}".format(m1[1], m2[1], address)
+
+    if m1[0] == m2[0]:
+      return (self.roboclaw.SpeedAccelM1M2, (address, m1[0], m1[1], m2[1]), error)
+    else:
+      return (self.roboclaw.SpeedAccelM1M2_2, (address,) + m1 + m2, error)
+
+  @staticmethod
+  def by_address(targets):
+    """
+    Groups (address, motor, params) tuples into a list of
+    (address, {motor: params}) in order each address was first seen.
+    """
+    addresses = []
+    motors = dict()
+    for address, motor, params in targets:
+      if address not in motors:
+        addresses.append(address)
+        motors[address] = dict()
+      motors[address][motor] = params
+    return [(address, motors[address]) for address in addresses]
+
+  def batch_commands(self, targets, command, pair_command):
+    """
+    Returns list of (API function, arguments, error message) for targets
+    from angle_params() or velocity_params(). Where both motors of an
+    address are present they are merged into one pair_command packet,
+    otherwise each motor gets its own command.
+    """
+    commands = []
+    for address, motors in self.by_address(targets):
+      if len(motors) == 2:
+        commands.append(pair_command(address, motors[1], motors[2]))
+      else:
+        for motor, params in motors.items():
+          commands.append(command(address, motor, params))
+    return commands
+
+  def apply_batch(self, velocities, angles):
+    """
+    Send angle and velocity commands for one motion update. When both
+    motors of a RoboClaw are commanded they are sent as a single combined
+    packet. Commands for all RoboClaw addresses on the bus are pipelined:
+    sent back to back then acknowledgements are collected in order, instead
+    of waiting for each one before sending the next. They all replace
+    whatever the motor was doing (immediate execution), so the pipeline
+    sending one again after a lost ack does no harm.
+    """
+    self.check_roboclaw()
+
+    angleparams = [self.angle_params(id, angle) for id, angle in angles]
+    velocityparams = [self.velocity_params(id, velocity) for id, velocity in velocities]
+
+    for address, motor, params in angleparams + velocityparams:
+      self.segments.pop((address, motor), None)
+
+    commands = self.batch_commands(angleparams,
+      self.angle_single_command, self.angle_pair_command)
+    commands.extend(self.batch_commands(velocityparams,
+      self.velocity_single_command, self.velocity_pair_command))
+
+    results = self.roboclaw.Pipelined([(function, args) for function, args, error in commands])
+
+    for result, command in zip(results, commands):
+      apiset(result, command[2])
+
+  def queue_velocity_segment(self, id, pct_velocity, duration):
+    """
+    Queue a segment running the specified motor at percentage of maximum
+    velocity for duration seconds. Queued segments are fed into the
+    RoboClaw command buffer by poll() and run one after another with
+    RoboClaw timing. Any immediate command to the motor discards them.
+    """
+    address, motor, params = self.velocity_params(id, pct_velocity)
+    acceleration, qpps = params
+    distance = int(abs(qpps) * duration)
+    args = (address, acceleration, qpps, distance, buffered_execution)
+    error = "Queue velocity {} for {} counts on RoboClaw M{}@{}".format(qpps, distance, motor, address)
+
+    if motor==1:
+      command = (self.roboclaw.SpeedAccelDistanceM1, args, error)
+    else:
+      command = (self.roboclaw.SpeedAccelDistanceM2, args, error)
+
+    self.segments.setdefault((address, motor), collections.deque()).append(command)
+
+  def queue_angle_segment(self, id, angle):
+    """
+    Queue a segment moving the specified motor to angle, after previously
+    queued segments complete. See queue_velocity_segment().
+    """
+    address, motor, params = self.angle_params(id, angle)
+    args = (address,) + params + (buffered_execution,)
+    error = "Queue position {} on RoboClaw M{}@{}".format(params[3], motor, address)
+
+    if motor==1:
+      command = (self.roboclaw.SpeedAccelDeccelPositionM1, args, error)
     else:
-      apiset(self.roboclaw.SpeedAccelDeccelPositionM2(*args), error)
+      command = (self.roboclaw.SpeedAccelDeccelPositionM2, args, error)
+
+    self.segments.setdefault((address, motor), collections.deque()).append(command)
+
+  def poll(self):
+    """
+    Called periodically by the chassis. Reads command buffer status of every
+    RoboClaw with queued segments and tops each buffer up to the configured
+    depth.
+
+    Segments are sent one at a time without retry, not pipelined: a lost
+    ack can't be told apart from a lost segment, and sending it again may
+    queue the same move twice. Sending stops at the first failure, the
+    segments not yet sent stay queued for the next poll. The failed one is
+    dropped: it is logged, and raised as an error.
+    """
+    waiting = [key for key, queue in self.segments.items() if queue]
+    if not waiting:
+      return
+    self.check_roboclaw()
+
+    addresses = sorted(set(address for address, motor in waiting))
+    status = self.roboclaw.Pipelined([(self.roboclaw.ReadBuffers, (address,)) for address in addresses])
+
+    commands = []
+    for address, result in zip(addresses, status):
+      buffers = apiget(result, "RoboClaw ReadBuffers @ {}".format(address))
+      for motor in (1, 2):
+        queue = self.segments.get((address, motor))
+        queued = buffers[motor-1]
+        if queued == buffer_idle:
+          queued = 0
+        while queue and queued < self.bufferdepth:
+          commands.append((queue, queue.popleft()))
+          queued = queued + 1
+
+    for index, (queue, command) in enumerate(commands):
+      function, args, error = command
+      if not self.roboclaw.Once(function, args):
+        for queue, command in reversed(commands[index+1:]):
+          queue.appendleft(command)
+        logging.getLogger(__name__).warning("Segment dropped, RoboClaw may or may not have queued it: %s", error)
+        apiset(False, "Dropped segment: {}".format(error))
 
   def steer_setzero(self, id):
     """
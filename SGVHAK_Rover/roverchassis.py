@@ -23,16 +23,65 @@ SOFTWARE.
 """
 import math
 import logging
+import time
+import threading
+import bus_worker
 import configuration
+import control_loop
+import motion_mailbox
+import motion_profile
+import odometry
 import roboclaw_wrapper
 import adafruit_servo_wrapper
 import lewansoul_wrapper
 import dynamixel_wrapper
+import dynamixel_protocol2
 import dmfe_wrapper
 
+# NumPy is optional, only needed for batch evaluation of many commands.
+try:
+  import kinematics_engine
+except ImportError:
+  kinematics_engine = None
+
 # Python 2 does not have a constant for infinity. (Python 3 added math.inf.)
 infinity = float("inf")
 
+def send_due(control, value, sent, senttime, deadband, now):
+  """
+  Decide if a value needs to be sent to a motor control, given the last
+  value actually sent (None if unknown) and when it was sent. Deadband is
+  the name of the control's attribute for the smallest change worth
+  sending. Controls may also specify a refresh_interval in seconds, after
+  which an unchanged value is sent again.
+  """
+  if sent is None:
+    return True
+
+  if abs(value - sent) > getattr(control, deadband, 0):
+    return True
+
+  refresh = getattr(control, 'refresh_interval', None)
+  if refresh is not None and now - senttime >= refresh:
+    return True
+
+  return False
+
+def apply_batch(control, velocities, angles):
+  """
+  Send a batch of commands to one motor control. Velocities and angles are
+  lists of (param, value) tuples. Controls that can command several motors
+  at once implement apply_batch(velocities, angles) to do so, the rest get
+  one command per motor.
+  """
+  if hasattr(control, 'apply_batch'):
+    control.apply_batch(velocities, angles)
+  else:
+    for param, angle in angles:
+      control.angle(param, angle)
+    for param, velocity in velocities:
+      control.velocity(param, velocity)
+
 class roverwheel:
   """
   Rover wheel class tracks information specific to a particular wheel on
@@ -62,6 +111,19 @@ class roverwheel:
     self.angle = 0
     self.velocity = 0
 
+    # The most recent angle and velocity actually sent to the motor controls
+    # and when they were sent. None means we don't know what the motor is
+    # doing and the next value must be sent.
+    self.sentangle = None
+    self.sentangletime = 0
+    self.sentvelocity = None
+    self.sentvelocitytime = 0
+
+    # Steering angle and relative velocity precomputed at evenly spaced
+    # turning radius, filled in by chassis.build_kinematics_tables()
+    self.angletable = None
+    self.velocitytable = None
+
     # If we were given a rolling velocity control, run any initialization we
     # need and obtain its label string to show to user.
     if self.rollingcontrol:
@@ -86,29 +148,74 @@ class roverwheel:
     """
     self.velocity = 0
     if self.rollingcontrol:
-      self.rollingcontrol.power_percent(self.rollingparam, 0)
+      self.poweroff_rolling()
 
     # Killing the power leaves the angle wherever it was last (except as
     # moved by external forces) so leave self.angle alone.
     if self.steeringcontrol:
-      self.steeringcontrol.power_percent(self.steeringparam, 0)
+      self.poweroff_steering()
+
+  def poweroff_rolling(self):
+    """ Cut power to rolling motor. Caller must verify there is one. """
+    self.velocity = 0
+    self.sentvelocity = None
+    self.rollingcontrol.power_percent(self.rollingparam, 0)
+
+  def poweroff_steering(self):
+    """ Cut power to steering motor. Caller must verify there is one. """
+    self.sentangle = None
+    self.steeringcontrol.power_percent(self.steeringparam, 0)
 
-  def anglevelocity(self):
+  def velocity_due(self, now):
     """
-    Send the dictated angle and velocity to their respective controls
+    Returns True if the rolling velocity needs to be sent to its control.
+    Values that are within the control's deadband of what was last sent
+    are skipped unless it's time for a refresh.
     """
-    if self.rollingcontrol:
+    return send_due(self.rollingcontrol, self.velocity, self.sentvelocity,
+      self.sentvelocitytime, 'velocity_deadband', now)
+
+  def angle_due(self, now):
+    """
+    Returns True if the steering angle needs to be sent to its control.
+    """
+    return send_due(self.steeringcontrol, self.angle, self.sentangle,
+      self.sentangletime, 'angle_deadband', now)
+
+  def velocity_sent(self, velocity, now):
+    """ Record the rolling velocity successfully sent to its control. """
+    self.sentvelocity = velocity
+    self.sentvelocitytime = now
+
+  def angle_sent(self, angle, now):
+    """ Record the steering angle successfully sent to its control. """
+    self.sentangle = angle
+    self.sentangletime = now
+
+  def anglevelocity(self, force=False):
+    """
+    Send the dictated angle and velocity to their respective controls. To
+    reduce traffic on the motor control bus, values that didn't change
+    enough to matter are skipped unless the caller forces a send.
+    """
+    now = time.time()
+
+    if self.rollingcontrol and (force or self.velocity_due(now)):
       self.rollingcontrol.velocity(self.rollingparam, self.velocity)
+      self.velocity_sent(self.velocity, now)
 
-    if self.steeringcontrol:
+    if self.steeringcontrol and (force or self.angle_due(now)):
       self.steeringcontrol.angle(self.steeringparam, self.angle)
+      self.angle_sent(self.angle, now)
 
   def steerto(self, angle):
     """
     Steer this wheel to the specified angle. Caller is responsible for
     validation of all parameters.
     """
+    self.sentangle = None
     self.steeringcontrol.angle(self.steeringparam, angle)
+    self.angle_sent(angle, time.time())
 
   def steersetzero(self):
     """
@@ -117,20 +224,24 @@ class roverwheel:
     """
     self.steeringcontrol.steer_setzero(self.steeringparam)
 
-  def motor_voltage(self):
+  def motor_voltage(self, run=None):
     """
     Query the rolling and steering motor controllers for their current input
-    voltage levels
+    voltage levels. Each query is made with run(control, function, *args)
+    if given, such as chassis.run_on_bus, otherwise called directly.
     """
+    if run is None:
+      run = lambda control, function, *args: function(*args)
+
     voltages = dict()
 
     if self.rollingcontrol:
-      voltages["Rolling"] = self.rollingcontrol.input_voltage(self.rollingparam)
+      voltages["Rolling"] = run(self.rollingcontrol, self.rollingcontrol.input_voltage, self.rollingparam)
     else:
       voltages["Rolling"] = "Not Applicable"
 
     if self.steeringcontrol:
-      voltages["Steering"] = self.steeringcontrol.input_voltage(self.steeringparam)
+      voltages["Steering"] = run(self.steeringcontrol, self.steeringcontrol.input_voltage, self.steeringparam)
     else:
       voltages["Steering"] = "Not Applicable"
 
@@ -172,6 +283,155 @@ class chassis:
     #   to an instance of the motor controller.
     self.motorcontrollers = dict()
 
+    # Number of turning radius steps between minRadius and maxRadius in the
+    #   precomputed kinematics tables, built by build_kinematics_tables()
+    #   every time the radius limits change. Zero disables the tables and
+    #   every update is calculated from scratch.
+    self.kinematics_steps = 1000
+    self.kinematics_scale = 0
+
+    # When set, every table lookup is checked against the exact calculation
+    #   and the largest (angle, velocity) error seen is kept in
+    #   kinematics_error.
+    self.kinematics_verify = False
+    self.kinematics_error = (0, 0)
+
+    # Array-backed kinematics engine for batch_angle_velocity(), rebuilt
+    #   along with the lookup tables. Stays None if NumPy is not installed.
+    self.kinematics_engine = None
+
+    # Send each motor control's batch from a worker thread dedicated to its
+    #   bus, so all buses are busy at the same time. When dispatch_wait is
+    #   set, updates return after every bus is done. Otherwise they return
+    #   immediately and errors are logged on the following update, and an
+    #   update still waiting for a busy bus is replaced by the next one.
+    #   Both are read from config_motion.json by load_motion_config()
+    self.parallel_dispatch = False
+    self.dispatch_wait = True
+
+    # Map each motor control to its bus_worker, and the jobs submitted to
+    #   them that nobody waited for, guarded by dispatchlock as updates come
+    #   from several threads.
+    self.busworkers = dict()
+    self.dispatchjobs = list()
+    self.dispatchlock = threading.Lock()
+
+    # Optional mailbox between motion command sources (HTTP requests, RC
+    #   receiver) and the motors, started by init_mailbox() if enabled in
+    #   config_motion.json. It keeps only the newest command and applies
+    #   them no faster than mailbox_rate per second.
+    self.mailbox_enabled = False
+    self.mailbox_rate = 20
+    self.mailbox = None
+
+    # Optional fixed-rate control loop thread, applies the newest command
+    #   from the mailbox at control_frequency ticks per second. Optionally
+    #   with real-time scheduling priority and pinned to a CPU core. Takes
+    #   the place of the mailbox thread when enabled.
+    self.control_loop_enabled = False
+    self.control_frequency = 50
+    self.control_realtime = False
+    self.control_priority = 10
+    self.control_cpu = None
+    self.control_loop = None
+
+    # Seconds between giving motor controls a chance to do periodic work via
+    #   their optional poll() method. Done by the control loop.
+    self.poll_interval = 0.1
+
+    # Optional motion profile for the control loop. Ramps velocity under
+    #   acceleration (percent/second) and jerk (percent/second^2) limits, and
+    #   steering under turn rate limit (full steering lock per second).
+    self.profile_enabled = False
+    self.profile_acceleration = 100
+    self.profile_jerk = 400
+    self.profile_turn_rate = 2
+
+    # Incremented whenever a stop preempts motion updates in progress. Work
+    #   queued for an older generation is skipped.
+    self.motion_generation = 0
+
+    # Measured wheel state from motor controls that can report it via their
+    #   optional telemetry() method. Dictionary of wheel name to dictionary
+    #   with 'rolling' and/or 'steering' sample dictionaries.
+    self.telemetry = dict()
+
+    # Dead reckoning of rover position and velocity from wheel encoder
+    #   telemetry, advanced by poll_controls() once every control in a
+    #   round of polls has been read. Polls of a round may finish on
+    #   different bus workers, they count down under polllock.
+    self.odometry = odometry.odometry()
+    self.polllock = threading.Lock()
+
+  def load_motion_config(self):
+    """
+    Read optional motion settings from config_motion.json. If the file is
+    absent, everything stays at default values.
+    """
+    try:
+      config = configuration.configuration("motion").load()
+    except IOError as ioe:
+      logging.getLogger(__name__).info("Using default motion settings: %s", str(ioe))
+      return
+
+    dispatch = config.get('dispatch', dict())
+    self.parallel_dispatch = dispatch.get('parallel', self.parallel_dispatch)
+    self.dispatch_wait = dispatch.get('wait', self.dispatch_wait)
+
+    mailbox = config.get('mailbox', dict())
+    self.mailbox_enabled = mailbox.get('enabled', self.mailbox_enabled)
+    self.mailbox_rate = mailbox.get('rate', self.mailbox_rate)
+
+    loop = config.get('control_loop', dict())
+    self.control_loop_enabled = loop.get('enabled', self.control_loop_enabled)
+    self.control_frequency = loop.get('frequency', self.control_frequency)
+    self.control_realtime = loop.get('realtime', self.control_realtime)
+    self.control_priority = loop.get('priority', self.control_priority)
+    self.control_cpu = loop.get('cpu', self.control_cpu)
+    self.poll_interval = loop.get('poll_interval', self.poll_interval)
+
+    profile = config.get('profile', dict())
+    self.profile_enabled = profile.get('enabled', self.profile_enabled)
+    self.profile_acceleration = profile.get('acceleration', self.profile_acceleration)
+    self.profile_jerk = profile.get('jerk', self.profile_jerk)
+    self.profile_turn_rate = profile.get('turn_rate', self.profile_turn_rate)
+
+  def init_busworkers(self):
+    """
+    Start a worker thread for every motor control, if parallel dispatch is
+    enabled.
+    """
+    if not self.parallel_dispatch:
+      return
+
+    for name, control in self.motorcontrollers.iteritems():
+      worker = bus_worker.bus_worker("bus_worker_{}".format(name))
+      worker.start()
+      self.busworkers[control] = worker
+
+  def init_mailbox(self):
+    """
+    Start the motion mailbox thread, or the control loop that takes its
+    place, if enabled.
+    """
+    if not (self.mailbox_enabled or self.control_loop_enabled):
+      return
+
+    self.mailbox = motion_mailbox.motion_mailbox(self, self.mailbox_rate)
+
+    if self.control_loop_enabled:
+      profile = None
+      if self.profile_enabled:
+        profile = motion_profile.motion_profile(self, self.profile_acceleration,
+          self.profile_jerk, self.profile_turn_rate)
+
+      self.control_loop = control_loop.control_loop(self, self.control_frequency,
+        self.control_realtime, self.control_priority, self.control_cpu, profile,
+        self.poll_interval)
+      self.control_loop.start()
+    else:
+      self.mailbox.start()
+
   def init_motorcontrollers(self):
     """
     Creates the dictionary where a name in the configuration file can be
@@ -219,7 +479,12 @@ class chassis:
       logging.getLogger(__name__).error("Unable to initialize Teensy Motors Library: %s",str(se))
 
     try:
-      dms = dynamixel_wrapper.dynamixel_wrapper()
+      # Servos speaking Dynamixel Protocol 2.0 (X series) or 1.0 (AX series)
+      dmsconnect = configuration.configuration("dynamixel").load()['connect']
+      if dmsconnect.get('protocol', 1) == 2:
+        dms = dynamixel_protocol2.dynamixel_protocol2()
+      else:
+        dms = dynamixel_wrapper.dynamixel_wrapper()
       dms.connect()
       self.motorcontrollers['dynamixel'] = dms
     except StandardError as se:
@@ -241,7 +506,9 @@ class chassis:
       return
 
     # Initialize motor controller dictionary.
+    self.load_motion_config()
     self.init_motorcontrollers()
+    self.init_busworkers()
 
     # Load configuration from JSON.
     config = configuration.configuration("roverchassis")
@@ -296,6 +563,21 @@ class chassis:
     # Wheels are initialized, set everything to zero.
     self.move_velocity_radius(0)
 
+    # Ready to accept motion commands via mailbox.
+    self.init_mailbox()
+
+  def check_velocity_radius(self, velocity, radius):
+    """
+    Raises ValueError if the given velocity and radius is not something this
+    chassis can do.
+    """
+    if abs(radius) < self.minRadius:
+      # This chassis configuration could not make that tight of a turn.
+      raise ValueError("Radius below minimum")
+
+    if abs(velocity) > 100:
+      raise ValueError("Velocity percentage may not exceed 100")
+
   def move_velocity_radius(self, velocity, radius=infinity):
     """
     Given the desired velocity and turning radius, update the angle and
@@ -306,20 +588,288 @@ class chassis:
     Radius of zero indicates a turn-in-place movement. (Not yet implemented)
     Radius of infinity indicates movement in a straight line.
     """
-    if abs(radius) < self.minRadius:
-      # This chassis configuration could not make that tight of a turn.
-      raise ValueError("Radius below minimum")
-
-    if abs(velocity) > 100:
-      raise ValueError("Velocity percentage may not exceed 100")
+    self.check_velocity_radius(velocity, radius)
 
     self.currentMotion = (velocity, radius)
 
+    # Use the precomputed tables when they cover this radius, fall back to
+    # the exact calculation when they don't.
+    wheelmotion = self.table_angle_velocity(velocity, radius)
+    if wheelmotion is None:
+      wheelmotion = self.exact_angle_velocity(velocity, radius)
+    elif self.kinematics_verify:
+      self.verify_angle_velocity(wheelmotion, velocity, radius)
+
+    for name, (angle, wheelvelocity) in wheelmotion.iteritems():
+      wheel = self.wheels[name]
+      wheel.angle = angle
+      wheel.velocity = wheelvelocity
+
+    self.send_wheel_commands()
+
+  def queue_motion_segment(self, velocity, radius, duration):
+    """
+    Queue a segment of motion at velocity and radius, as for
+    move_velocity_radius(), lasting duration seconds. It starts when the
+    segments queued before it are done, timed by the motor controls
+    instead of by when commands are sent. Every wheel's motor controls must
+    be able to queue segments, as roboclaw_wrapper can. Queued segments are
+    fed to the motor controls by their poll() from the control loop. Any
+    immediate command, such as move_velocity_radius() or a stop, discards
+    them.
+    """
+    self.check_velocity_radius(velocity, radius)
+    if not self.control_loop or not self.control_loop.poll_interval:
+      raise ValueError("Motion segments need the control loop to poll motor controls")
+
+    for wheel in self.wheels.values():
+      if wheel.rollingcontrol and not hasattr(wheel.rollingcontrol, 'queue_velocity_segment'):
+        raise ValueError("Rolling control of wheel {} can't queue motion segments".format(wheel.name))
+      if wheel.steeringcontrol and not hasattr(wheel.steeringcontrol, 'queue_angle_segment'):
+        raise ValueError("Steering control of wheel {} can't queue motion segments".format(wheel.name))
+
+    wheelmotion = self.table_angle_velocity(velocity, radius)
+    if wheelmotion is None:
+      wheelmotion = self.exact_angle_velocity(velocity, radius)
+
+    # Wheels end up wherever the segments leave them, so the next immediate
+    # command must be sent whatever it is.
+    for name, (angle, wheelvelocity) in wheelmotion.iteritems():
+      wheel = self.wheels[name]
+      if wheel.steeringcontrol:
+        wheel.steeringcontrol.queue_angle_segment(wheel.steeringparam, angle)
+        wheel.sentangle = None
+      if wheel.rollingcontrol:
+        wheel.rollingcontrol.queue_velocity_segment(wheel.rollingparam, wheelvelocity, duration)
+        wheel.sentvelocity = None
+
+  def send_wheel_commands(self, force=False):
+    """
+    Send wheel angles and velocities to their motor controls. Commands are
+    grouped by motor control so each one receives a single batch per update,
+    with steering angles ahead of rolling velocities. Values that haven't
+    changed enough to matter are left out unless forced.
+    """
+    now = time.time()
+
+    # Map each motor control to the velocities and angles it needs to
+    # handle in this update, and the wheels they belong to.
+    batches = dict()
+    for wheel in self.wheels.values():
+      if wheel.rollingcontrol and (force or wheel.velocity_due(now)):
+        batch = batches.setdefault(wheel.rollingcontrol, ([], [], [], []))
+        batch[0].append((wheel.rollingparam, wheel.velocity))
+        batch[2].append(wheel)
+
+      if wheel.steeringcontrol and (force or wheel.angle_due(now)):
+        batch = batches.setdefault(wheel.steeringcontrol, ([], [], [], []))
+        batch[1].append((wheel.steeringparam, wheel.angle))
+        batch[3].append(wheel)
+
+    generation = self.motion_generation
+    work = dict()
+    for control, batch in batches.iteritems():
+      work[control] = (self.send_batch, (control, batch, now, generation))
+    self.dispatch(work)
+
+  def send_batch(self, control, batch, now, generation):
+    """
+    Send one batch assembled by send_wheel_commands() to its motor control
+    and record what each wheel was sent. Skipped if a newer motion command
+    has preempted the update it belongs to.
+
+    Values recorded are the ones in the batch, not the wheel's current
+    ones: a newer command may have changed those while the batch was on
+    the bus, and must still be seen as due.
+    """
+    if generation != self.motion_generation:
+      return
+
+    velocities, angles, rolling, steering = batch
+    apply_batch(control, velocities, angles)
+
+    for wheel, (param, velocity) in zip(rolling, velocities):
+      wheel.velocity_sent(velocity, now)
+    for wheel, (param, angle) in zip(steering, angles):
+      wheel.angle_sent(angle, now)
+
+  def dispatch(self, work):
+    """
+    Run work for each motor control. Work is a dictionary mapping a motor
+    control to a (function, args) tuple. With parallel dispatch the work
+    goes to each control's bus worker, otherwise it runs here one control
+    after another. Work still waiting on a bus is superseded by newer work
+    with the same function.
+    """
+    if not self.busworkers:
+      for function, args in work.values():
+        function(*args)
+      return
+
+    with self.dispatchlock:
+      # Report any failure from previous updates that nobody waited for,
+      # keep track of those not finished yet.
+      unfinished = list()
+      for job in self.dispatchjobs:
+        if not job.done.is_set():
+          unfinished.append(job)
+        elif job.exception:
+          logging.getLogger(__name__).error("Motor control update failed: %s", str(job.exception))
+
+      # Fan out to every bus at once.
+      jobs = list()
+      for control, (function, args) in work.iteritems():
+        jobs.append(self.busworkers[control].submit_latest(function, *args))
+
+      if self.dispatch_wait:
+        self.dispatchjobs = unfinished
+      else:
+        self.dispatchjobs = unfinished + jobs
+
+    if self.dispatch_wait:
+      for job in jobs:
+        job.done.wait()
+      for job in jobs:
+        job.wait()
+
+  def run_on_bus(self, control, function, *args):
+    """
+    Call function(*args) that talks to the given motor control and return
+    its result. With parallel dispatch it runs on the control's bus worker,
+    in line with motion updates, so nothing else uses the bus at the same
+    time. Otherwise it runs here.
+    """
+    worker = self.busworkers.get(control)
+    if worker is None:
+      return function(*args)
+    return worker.submit(function, *args).wait()
+
+  def poll_controls(self):
+    """
+    Call poll() on every motor control that has one, to let it do periodic
+    work such as keeping command queues topped up, and read telemetry from
+    those that report it. Goes through dispatch so each poll takes its
+    turn on the bus with motion updates. Whichever poll finishes last then
+    advances odometry with wheel distances in the telemetry, so it always
+    sees the whole round even when dispatch doesn't wait for it.
+    """
+    controls = [control for control in self.motorcontrollers.values()
+      if hasattr(control, 'poll') or hasattr(control, 'telemetry')]
+    if not controls:
+      return
+
+    # Number of polls in this round not yet finished.
+    pollround = [len(controls)]
+    work = dict()
+    for control in controls:
+      work[control] = (self.poll_control, (control, pollround))
+    self.dispatch(work)
+
+  def poll_control(self, control, pollround):
+    """ Periodic work for one motor control, see poll_controls(). """
+    try:
+      if hasattr(control, 'poll'):
+        control.poll()
+      if hasattr(control, 'telemetry'):
+        self.read_telemetry(control)
+    finally:
+      with self.polllock:
+        pollround[0] = pollround[0] - 1
+        last = (pollround[0] == 0)
+      if last:
+        self.odometry.update(self.wheels, self.telemetry)
+
+  def read_telemetry(self, control):
+    """
+    Read measured state of every wheel motor on given motor control in one
+    telemetry() call, and record it in self.telemetry.
+    """
+    motors = list()
+    for name, wheel in self.wheels.iteritems():
+      if wheel.rollingcontrol == control:
+        motors.append((name, 'rolling', wheel.rollingparam))
+      if wheel.steeringcontrol == control:
+        motors.append((name, 'steering', wheel.steeringparam))
+    if not motors:
+      return
+
+    samples = control.telemetry([param for name, kind, param in motors])
+    for name, kind, param in motors:
+      sample = samples.get(control.check_id(param))
+      if sample:
+        self.telemetry.setdefault(name, dict())[kind] = sample
+
+  def stop_wheels(self):
+    """
+    Power off every wheel's motors, grouped by motor control the same way
+    as drive updates so it can go through the bus workers. Preempts any
+    drive update still in progress.
+    """
+    self.motion_generation = self.motion_generation + 1
+    self.currentMotion = (0, infinity)
+
+    groups = dict()
+    for wheel in self.wheels.values():
+      if wheel.rollingcontrol:
+        groups.setdefault(wheel.rollingcontrol, ([], []))[0].append(wheel)
+      if wheel.steeringcontrol:
+        groups.setdefault(wheel.steeringcontrol, ([], []))[1].append(wheel)
+
+    work = dict()
+    for control, (rolling, steering) in groups.iteritems():
+      work[control] = (self.poweroff_group, (rolling, steering))
+    self.dispatch(work)
+
+  def poweroff_group(self, rolling, steering):
+    """ Power off the given wheels' rolling and steering motors. """
+    for wheel in rolling:
+      wheel.poweroff_rolling()
+    for wheel in steering:
+      wheel.poweroff_steering()
+
+  def post_motion(self, velocity, radius=infinity):
+    """
+    Entry point for motion commands from the user interface and RC receiver.
+    Parameters are validated right away. If the motion mailbox is enabled
+    the command is handed to it and this returns without waiting for the
+    motors, otherwise the command is executed immediately.
+    """
+    self.check_velocity_radius(velocity, radius)
+
+    if self.mailbox:
+      if velocity == 0:
+        # Stopping should never wait behind an update that is in progress.
+        self.motion_generation = self.motion_generation + 1
+      self.mailbox.post(velocity, radius)
+    else:
+      self.move_velocity_radius(velocity, radius)
+
+  def post_stop(self):
+    """
+    Entry point for stop command from the user interface. With the motion
+    mailbox enabled, any pending motion is discarded and the mailbox thread
+    powers off the wheels without delay. Otherwise it is done immediately.
+    """
+    if self.mailbox:
+      self.motion_generation = self.motion_generation + 1
+      self.mailbox.post_stop()
+    else:
+      self.stop_wheels()
+
+  def exact_angle_velocity(self, velocity, radius):
+    """
+    Calculate the angle and velocity of every wheel from scratch. This is
+    the reference implementation: the lookup tables are built from it, and
+    it is used for any radius the tables do not cover.
+
+    Returns a dictionary mapping wheel name to an (angle, velocity) tuple.
+    """
+    wheelmotion = dict()
+
     if radius > self.maxRadius:
       # Straight line travel
       for wheel in self.wheels.values():
-        wheel.angle = 0
-        wheel.velocity = velocity
+        wheelmotion[wheel.name] = (0, velocity)
     else:
       # Calculate angle and velocity for each wheel
       for wheel in self.wheels.values():
@@ -331,44 +881,184 @@ class chassis:
 
         # Calculate wheel steering angle to execute the commanded motion.
         if adj == 0:
-          wheel.angle = 90
+          angle = 90
         else:
-          wheel.angle = math.degrees(math.atan(float(opp)/float(adj)))
+          angle = math.degrees(math.atan(float(opp)/float(adj)))
 
         # Calculate wheel rolling velocity to execute the commanded motion.
         if radius == 0:
-          wheel.velocity = 0 # TODO: Velocity calculation for spin-in-place where radius is zero
+          wheelvelocity = 0 # TODO: Velocity calculation for spin-in-place where radius is zero
         else:
-          wheel.velocity = velocity * hyp/abs(radius)
+          wheelvelocity = velocity * hyp/abs(radius)
 
         # If center of rotation is within the wheel track, and between the
         # wheel and the origin, then this wheel will need to turn in the
         # opposite direction so the rover body can turn about the center.
         if (radius < 0 and wheel.x < 0 and wheel.x < radius) or (radius > 0 and wheel.x > 0 and wheel.x > radius):
-          wheel.velocity = -wheel.velocity
+          wheelvelocity = -wheelvelocity
+
+        wheelmotion[wheel.name] = (angle, wheelvelocity)
 
     # Go back and normalize al the wheel roll rate magnitude so they are at or
     # below target velocity while maintaining relative ratios between their rates.
     maxCalculated = 0
 
-    for wheel in self.wheels.values():
-      if abs(wheel.velocity) > maxCalculated:
-        maxCalculated = abs(wheel.velocity)
+    for angle, wheelvelocity in wheelmotion.values():
+      if abs(wheelvelocity) > maxCalculated:
+        maxCalculated = abs(wheelvelocity)
 
     if maxCalculated > velocity:
       # At least one wheel exceeded specified maxVelocity, calculate
       # normalization ratio and apply to every wheel.
       reductionRatio = abs(velocity)/float(maxCalculated)
+      for name, (angle, wheelvelocity) in wheelmotion.items():
+        wheelmotion[name] = (angle, wheelvelocity * reductionRatio)
+
+    return wheelmotion
+
+  def build_kinematics_tables(self):
+    """
+    Precompute the steering angle and relative velocity of every wheel at
+    evenly spaced turning radius between minRadius and maxRadius, one set
+    for turning right (positive radius) and one for turning left (negative
+    radius). Tables are stored on each wheel and interpolated by
+    table_angle_velocity().
+
+    Some radius intervals can't be interpolated: where the center of
+    rotation passes over a wheel, its angle flips from +90 to -90 degrees
+    and its velocity changes direction. Those intervals are flagged so the
+    exact calculation is used instead.
+    """
+    steps = self.kinematics_steps
+    span = self.maxRadius - self.minRadius
+    if steps < 1 or span <= 0 or len(self.wheels) == 0:
+      self.kinematics_scale = 0
+      return
+
+    self.kinematics_scale = steps/float(span)
+
+    # Interval flags, for turning right [0] and left [1].
+    #   kinematics_exact - always use exact math within this interval.
+    #   kinematics_reverse_exact - use exact math when velocity is negative.
+    #     (Velocity normalization treats negative velocity differently when
+    #     no wheel needs to roll faster than rover center.)
+    self.kinematics_exact = ([False]*steps, [False]*steps)
+    self.kinematics_reverse_exact = ([False]*steps, [False]*steps)
+
+    for wheel in self.wheels.values():
+      wheel.angletable = ([0]*(steps+1), [0]*(steps+1))
+      wheel.velocitytable = ([0]*(steps+1), [0]*(steps+1))
+
+    for direction, sign in ((0, 1), (1, -1)):
+      exact = self.kinematics_exact[direction]
+      reverse_exact = self.kinematics_reverse_exact[direction]
+
+      for i in range(steps+1):
+        radius = sign * (self.minRadius + i/self.kinematics_scale)
+
+        # A velocity of 1 gives each wheel's velocity relative to the
+        # commanded velocity, including normalization.
+        wheelmotion = self.exact_angle_velocity(1, radius)
+        maxCalculated = 0
+        for name, (angle, ratio) in wheelmotion.iteritems():
+          wheel = self.wheels[name]
+          wheel.angletable[direction][i] = angle
+          wheel.velocitytable[direction][i] = ratio
+          maxCalculated = max(maxCalculated, abs(ratio))
+
+        if maxCalculated < 1:
+          if i > 0:
+            reverse_exact[i-1] = True
+          if i < steps:
+            reverse_exact[i] = True
+
+      # Flag intervals where center of rotation crosses over a wheel.
       for wheel in self.wheels.values():
-        wheel.velocity = wheel.velocity * reductionRatio
+        crossing = sign * wheel.x
+        if self.minRadius <= crossing <= self.maxRadius:
+          i = int((crossing - self.minRadius) * self.kinematics_scale)
+          for flagged in (i-1, i, i+1):
+            if 0 <= flagged < steps:
+              exact[flagged] = True
+
+  def table_angle_velocity(self, velocity, radius):
+    """
+    Look up angle and velocity of every wheel from the tables built by
+    build_kinematics_tables(), interpolating between table entries.
+
+    Returns a dictionary mapping wheel name to an (angle, velocity) tuple, or
+    None if the tables do not cover this radius.
+    """
+    if not self.kinematics_scale:
+      return None
 
-    # We're sending commands for a particular wheel - steering and rolling
-    # velocity - before we move on to the next wheel. If this causes timing
-    # issues (wheels start moving before they've finished pointing in the
-    # right direction, etc.) we may have to send all steering commands first,
-    # wait until we reach the angles, before sending velocity commands.
+    if radius > 0:
+      direction = 0
+    else:
+      direction = 1
+
+    position = (abs(radius) - self.minRadius) * self.kinematics_scale
+    if position < 0 or position > self.kinematics_steps:
+      return None
+
+    i = int(position)
+    if i == self.kinematics_steps:
+      i = i - 1
+    fraction = position - i
+
+    if self.kinematics_exact[direction][i]:
+      return None
+    if velocity < 0 and self.kinematics_reverse_exact[direction][i]:
+      return None
+
+    wheelmotion = dict()
     for wheel in self.wheels.values():
-      wheel.anglevelocity()
+      angles = wheel.angletable[direction]
+      ratios = wheel.velocitytable[direction]
+      angle = angles[i] + (angles[i+1]-angles[i])*fraction
+      ratio = ratios[i] + (ratios[i+1]-ratios[i])*fraction
+      wheelmotion[wheel.name] = (angle, velocity * ratio)
+
+    return wheelmotion
+
+  def batch_angle_velocity(self, velocities, radii):
+    """
+    Calculate wheel angle and velocity for a whole series of (velocity,
+    radius) commands without sending anything to the motors. Intended for
+    trajectory previews and offline planning.
+
+    Returns a tuple (names, angles, velocities) where names lists the wheels
+    in column order of the angles and velocities arrays, which have one row
+    per command.
+    """
+    if self.kinematics_engine is None:
+      raise ValueError("Batch evaluation requires NumPy and a loaded chassis configuration")
+
+    engine = self.kinematics_engine
+    angles, wheelvelocities = engine.angle_velocity(velocities, radii)
+
+    if self.kinematics_verify:
+      for row, (velocity, radius) in enumerate(zip(velocities, radii)):
+        wheelmotion = dict()
+        for column, name in enumerate(engine.names):
+          wheelmotion[name] = (angles[row][column], wheelvelocities[row][column])
+        self.verify_angle_velocity(wheelmotion, velocity, radius)
+
+    return (engine.names, angles, wheelvelocities)
+
+  def verify_angle_velocity(self, wheelmotion, velocity, radius):
+    """
+    Compare table lookup or batch results against the exact calculation and record
+    the largest angle and velocity errors seen in kinematics_error.
+    """
+    maxangle, maxvelocity = self.kinematics_error
+
+    for name, (angle, wheelvelocity) in self.exact_angle_velocity(velocity, radius).iteritems():
+      tableangle, tablevelocity = wheelmotion[name]
+      maxangle = max(maxangle, abs(tableangle - angle))
+      maxvelocity = max(maxvelocity, abs(tablevelocity - wheelvelocity))
+
+    self.kinematics_error = (maxangle, maxvelocity)
 
   def calculate_radius_min_max(self):
     """
@@ -407,3 +1097,9 @@ class chassis:
 
     self.minRadius = limit_min
     self.maxRadius = limit_max
+
+    # Lookup tables and batch engine depend on radius limits, rebuild them.
+    self.build_kinematics_tables()
+    if kinematics_engine:
+      self.kinematics_engine = kinematics_engine.kinematics_engine(
+        self.wheels.values(), self.minRadius, self.maxRadius)
@@ -40,11 +40,20 @@ var requestWheels = function() {
 
 // Upon successful completion of POST started by requestWheels(), we receive
 // a chunk of JSON that represents the wheel status. Iterate through each
-// wheel and call updateWheelCanvas to draw the update in visual form.
+// wheel and call updateWheelCanvas to draw the update in visual form,
+// using measured angle and velocity where available instead of commanded.
 // If all goes well, set a timer to repeat the process soon.
 var updateWheels = function(data, textStatus, jqXHR) {
   Object.keys(data).forEach(function(key,index) {
-    updateWheelCanvas(key, data[key].angle, data[key].velocity);
+    var angle = data[key].angle;
+    var velocity = data[key].velocity;
+    if (data[key].measured_angle !== undefined) {
+      angle = data[key].measured_angle;
+    }
+    if (data[key].measured_velocity !== undefined) {
+      velocity = data[key].measured_velocity;
+    }
+    updateWheelCanvas(key, angle, velocity);
   })
   setTimeout(requestWheels, 200);
 }
@@ -0,0 +1,185 @@
+"""
+MIT License
+
+Copyright (c) 2018 Roger Cheng
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import logging
+import threading
+import time
+from array import array
+
+class teensy_encoders(threading.Thread):
+  """
+  Background thread that asks the Teensy ROS Arduino Bridge firmware for
+  its encoder counts (READ_ENCODERS, 'e') at a fixed rate, and keeps the
+  latest count, distance and velocity of every motor.
+
+  The firmware answers with one line of space separated counts. Motor
+  commands sent meanwhile by teensy_motors_wrapper get "OK" lines back,
+  which are skipped. Writes to the port from either side go through the
+  wrapper's write lock.
+
+  Counts are parsed straight out of a reusable line buffer into
+  preallocated arrays, without splitting strings or converting each
+  number through int().
+  """
+
+  # Rate of the firmware PID loop (PID_RATE). Motor speeds are commanded in
+  # encoder counts per PID frame, 254 of them for 100 percent.
+  pid_rate = 30
+  counts_per_percent = 2.54
+
+  def __init__(self, sp, writelock, motor_count, rate, distance_per_count):
+    threading.Thread.__init__(self, name="teensy_encoders")
+    self.setDaemon(True)
+    self.sp = sp
+    self.writelock = writelock
+    self.motor_count = motor_count
+    self.interval = 1.0/rate
+    self.distance_per_count = distance_per_count
+    self.running = True
+
+    # Bytes received but not yet parsed, up to the end of a line.
+    self.linebuffer = bytearray()
+
+    # Counts being parsed, latest counts, and counts of the sample before.
+    self.parsed = array('l', [0] * motor_count)
+    self.counts = array('l', [0] * motor_count)
+    self.lastcounts = array('l', [0] * motor_count)
+    self.lasttime = None
+
+    # Latest sample of each motor: dictionaries updated in place, guarded
+    # by samplelock. Uninverted, teensy_motors_wrapper applies inversion.
+    self.samplelock = threading.Lock()
+    self.samples = [None] * motor_count
+
+  def stop(self):
+    """ Ask thread to stop after the read in progress """
+    self.running = False
+
+  def run(self):
+    nexttime = time.time()
+    while self.running:
+      try:
+        with self.writelock:
+          self.sp.write(b'e\r')
+        self.receive(time.time() + self.sp.timeout)
+      except Exception as e:
+        logging.getLogger(__name__).error("Teensy encoder read failed: %s", str(e))
+
+      now = time.time()
+      nexttime = nexttime + self.interval
+      if nexttime > now:
+        time.sleep(nexttime - now)
+      else:
+        # Fell behind, start the schedule over instead of catching up.
+        nexttime = now
+
+  def receive(self, deadline):
+    """
+    Read lines until one with encoder counts arrives, or deadline passes.
+    """
+    buf = self.linebuffer
+    while time.time() < deadline:
+      buf.extend(self.sp.read(max(1, self.sp.in_waiting)))
+      end = buf.find(b'\n')
+      while end >= 0:
+        found = self.parse_counts(buf, end)
+        del buf[:end+1]
+        if found:
+          self.publish(time.time())
+          return True
+        end = buf.find(b'\n')
+    return False
+
+  def parse_counts(self, buf, end):
+    """
+    Parse buf[0:end] as a line of motor_count space separated integers
+    into self.parsed. Returns True if it was one, and copies them into
+    self.counts. Anything else (OK, Invalid Command) returns False.
+    """
+    parsed = self.parsed
+    n = 0
+    value = 0
+    negative = False
+    digits = False
+    i = 0
+    while i <= end:
+      c = buf[i] if i < end else 32
+      if 48 <= c <= 57:
+        value = value * 10 + c - 48
+        digits = True
+      elif c == 45 and not digits and not negative:
+        negative = True
+      elif c == 32 or c == 13:
+        if digits:
+          if n >= self.motor_count:
+            return False
+          parsed[n] = -value if negative else value
+          n = n + 1
+        elif negative:
+          return False
+        value = 0
+        negative = False
+        digits = False
+      else:
+        return False
+      i = i + 1
+
+    if n != self.motor_count:
+      return False
+    self.counts[:] = parsed
+    return True
+
+  def publish(self, now):
+    """
+    Turn latest counts into samples, with velocity from the change since
+    the previous sample.
+    """
+    dt = None
+    if self.lasttime is not None and now > self.lasttime:
+      dt = now - self.lasttime
+
+    with self.samplelock:
+      for i in range(self.motor_count):
+        sample = self.samples[i]
+        if sample is None:
+          sample = dict()
+          self.samples[i] = sample
+        count = self.counts[i]
+        sample['count'] = count
+        sample['distance'] = count * self.distance_per_count
+        if dt:
+          rate = (count - self.lastcounts[i]) / dt
+          sample['velocity'] = rate / self.pid_rate / self.counts_per_percent
+          sample['speed'] = rate * self.distance_per_count
+        sample['time'] = now
+
+    self.lastcounts[:] = self.counts
+    self.lasttime = now
+
+  def sample(self, motor):
+    """ Copy of latest sample for motor number, or None if there isn't one """
+    with self.samplelock:
+      sample = self.samples[motor]
+      if sample is None:
+        return None
+      return dict(sample)
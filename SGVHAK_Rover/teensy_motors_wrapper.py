@@ -1,18 +1,44 @@
 import datetime
 import logging
 import serial
+import threading
 from struct import *
 
 import configuration
+from teensy_encoders import teensy_encoders
 
 class teensy_motors_wrapper:
   """
   Class that implements the rover motor control methods for serial bus
   based on a Teensy 3.5 running a modified ROS Arduino Bridge
   """
+
+  # Deadbands and refresh interval used by roverchassis.roverwheel to skip
+  # sending commands that would not change anything.
+  # Motor power is 254 steps for 100 percent. Teensy firmware stops motors
+  # if it hasn't received a command for 2 seconds (AUTO_STOP_INTERVAL) so
+  # unchanged commands must be sent again before that.
+  angle_deadband = 0
+  velocity_deadband = 0.3
+  refresh_interval = 1.0
+
+  # Number of motors on the Teensy, all set at once by the MOTOR_SPEEDS
+  # ('m') command.
+  motor_count = 6
+
   def __init__(self):
     self.sp = None
 
+    # Last power sent to each motor, so a MOTOR_SPEEDS command covering
+    # all of them leaves motors not in the batch as they were.
+    self.powers = [0] * self.motor_count
+
+    # Serializes writes to the port between callers and encoder reader.
+    self.writelock = threading.Lock()
+
+    # Background encoder reader thread, if enabled in configuration.
+    self.encoders = None
+
   def check_sp(self):
     """ Raises error if we haven't opened serial port yet. """
     if self.sp == None:
@@ -26,7 +52,8 @@ class teensy_motors_wrapper:
     
     # Read parameter file
     config = configuration.configuration("teensy_motors")
-    connectparams = config.load()['connect']
+    allparams = config.load()
+    connectparams = allparams['connect']
     
     # Open serial port with parameters
     s = serial.Serial()
@@ -38,10 +65,20 @@ class teensy_motors_wrapper:
     if s.is_open:
       self.sp = s
 
+      encoderparams = allparams.get('encoders', dict())
+      if encoderparams.get('enabled', False):
+        self.encoders = teensy_encoders(s, self.writelock, self.motor_count,
+          encoderparams.get('rate', 10), encoderparams.get('distance_per_count', 1.0))
+        self.encoders.start()
+
   def close(self):
     """
     Closes down the serial port
     """
+    if self.encoders:
+      self.encoders.stop()
+      self.encoders.join()
+      self.encoders = None
     if self.sp.is_open:
       self.sp.close()
       self.sp = None
@@ -67,10 +104,12 @@ class teensy_motors_wrapper:
 
     return tuple(id)
 
-  def power_percent(self, id, percentage):
-    """ Runs motor at specified +/- percentage """
+  def power_value(self, id, percentage):
+    """
+    Translate a +/- percentage into the motor number and power value
+    (+/- 254) to send to it.
+    """
     mid, inverted = self.check_id(id)
-    self.check_sp()
 
     pct = int(percentage)
     if abs(pct) > 100:
@@ -82,8 +121,57 @@ class teensy_motors_wrapper:
     if inverted:
       power = power * -1
 
+    return (mid, power)
+
+  def power_percent(self, id, percentage):
+    """ Runs motor at specified +/- percentage """
+    self.check_sp()
+    mid, power = self.power_value(id, percentage)
+    self.powers[mid] = power
+
     # logging.getLogger('werkzeug').error("%s: teensy_motors.power_percent(%d, %f)  -> write(%d, %d)" % (datetime.datetime.utcnow().strftime("%H%M%S.%f"), mid, percentage, mid, power))
-    self.sp.write("n %d %d\r" % (mid, power))
+    with self.writelock:
+      self.sp.write("n %d %d\r" % (mid, power))
+
+  def apply_batch(self, velocities, angles):
+    """
+    Set all motors with one MOTOR_SPEEDS ('m') command line instead of a
+    SINGLE_MOTOR_SPEED ('n') line per motor. Motors not in the batch are
+    sent the power they were last given. There are no steering motors.
+    """
+    self.check_sp()
+    if not velocities:
+      return
+
+    for id, velocity in velocities:
+      mid, power = self.power_value(id, velocity)
+      self.powers[mid] = power
+
+    with self.writelock:
+      self.sp.write("m %d %d %d %d %d %d\r" % tuple(self.powers))
+
+  def telemetry(self, ids):
+    """
+    Latest encoder readings of listed motors from the background reader:
+    'count' and 'distance' travelled (in units of distance_per_count) since
+    the firmware started, 'velocity' in percent like velocity() and
+    'speed' in distance per second. Empty if encoder reading is disabled.
+    """
+    samples = dict()
+    if not self.encoders:
+      return samples
+
+    for id in ids:
+      mid, inverted = self.check_id(id)
+      sample = self.encoders.sample(mid)
+      if sample is None:
+        continue
+      if inverted:
+        for key in ('count', 'distance', 'velocity', 'speed'):
+          if key in sample:
+            sample[key] = -sample[key]
+      samples[(mid, inverted)] = sample
+    return samples
 
   def set_max_current(self, id, current):
     sid, center, inverted = self.check_id(id)
@@ -7,5 +7,7 @@ setup(
 	install_requires=[
                 'adafruit-pca9685',
 		'flask',
-		'pyserial'],
+		'pyserial>=3.0'],
+	extras_require={
+		'batch': ['numpy']},
 	)